@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import signal
+import tempfile
+import argparse
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+
+#   Measures requests per second through gunicorn for different numbers of worker processes.
+
+#   Run from the app directory: python benchmarks/load_test.py --workers 1 2 4 --threads 4 --clients 16
+
+#   Each run uses a fresh SQLite database and filesystem sessions in a temporary directory, so no database or Redis server is needed.
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#   \brief - Waits until the server answers requests.
+
+#   \param url - The URL to request.
+#   \param timeout - The number of seconds to wait before giving up.
+
+def wait_for_server(url,timeout=30):
+    start = time.time()
+    while time.time()-start < timeout:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start within "+str(timeout)+" seconds.")
+
+#   \brief - Requests a URL repeatedly from several threads at once for a fixed time.
+
+#   \param url - The URL to request.
+#   \param clients - The number of threads making requests.
+#   \param duration - The number of seconds to make requests for.
+
+#   \returns ok - The number of successful requests.
+#   \returns errors - The number of failed requests.
+
+def hammer(url,clients,duration):
+    counts = {"ok": 0, "errors": 0}
+    lock = threading.Lock()
+    end = time.time()+duration
+    def client():
+        while time.time() < end:
+            try:
+                urllib.request.urlopen(url, timeout=30).read()
+                result = "ok"
+            except (urllib.error.URLError, ConnectionError):
+                result = "errors"
+            with lock:
+                counts[result] += 1
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts["ok"], counts["errors"]
+
+#   \brief - Starts gunicorn with a number of workers, load tests it, then shuts it down gracefully.
+
+#   \param workers - The number of worker processes.
+#   \param args - The parsed command line arguments.
+#   \param directory - The temporary directory for the database and sessions.
+
+#   \returns - The number of successful requests per second, and the number of failed requests.
+
+def run(workers,args,directory):
+    env = dict(os.environ)
+    env.update({"WEB_WORKERS": str(workers),
+                "WEB_THREADS": str(args.threads),
+                "WEB_BIND": "127.0.0.1:"+str(args.port),
+                "SECRET_KEY": env.get("SECRET_KEY","benchmark"),
+                "SESSION_TYPE": "filesystem",
+                "SESSION_REDIS": env.get("SESSION_REDIS","redis://localhost:6379"),
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///"+os.path.join(directory,"load_test.sqlite"),
+                "PYTHONPATH": app_dir})
+    server = subprocess.Popen([sys.executable,"-m","gunicorn","--config",os.path.join(app_dir,"gunicorn.conf.py"),"--access-logfile","/dev/null","wsgi:app"], cwd=directory, env=env, stderr=subprocess.DEVNULL)
+    try:
+        url = "http://127.0.0.1:"+str(args.port)+args.path
+        wait_for_server(url)
+        hammer(url,args.clients,1) #Warm up every worker.
+        ok, errors = hammer(url,args.clients,args.duration)
+    finally:
+        server.send_signal(signal.SIGTERM) #Graceful shutdown.
+        server.wait()
+    return ok/args.duration, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1,2,4])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--path", default="/login")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in args.workers:
+            requests_per_second, errors = run(workers,args,directory)
+            print(str(workers)+" workers x "+str(args.threads)+" threads: "+str(round(requests_per_second,1))+" requests/s, "+str(errors)+" errors")
@@ -0,0 +1,107 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import feedparser
+from collections import Counter
+
+#   Compares normalising each story once at ingestion with the previous approach, which stripped HTML with a regular expression compiled on every call and lower-cased and stripped punctuation from every story again for every tag of every issue.
+
+#   Run from the app directory: python benchmarks/normalise.py --stories 20000
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from project.fetch import trunc_entries
+from project.matching import get_matcher
+from project.pipeline import count_words
+
+words = ("police crime murder schools exams queen prince harry meghan election economy market storm climate court judge "
+         "president minister vote war peace trade health hospital vaccine football league city council budget tax energy").split()
+
+#   \brief - Builds a large RSS feed, with HTML and entities in its summaries.
+
+#   \param stories - The number of stories in the feed.
+
+#   \returns - The feed as a string.
+
+def fixture_feed(stories):
+    random.seed(0)
+    items = []
+    for i in range(stories):
+        title = " ".join(random.choice(words).capitalize() for word in range(8))
+        summary = " ".join(random.choice(words) for word in range(40))
+        items.append("<item><title>"+title+" &amp; more</title><description>&lt;p&gt;&lt;b&gt;"+summary+"&lt;/b&gt; &amp;amp; more&lt;/p&gt;</description><link>http://example.com/"+str(i)+"</link></item>")
+    return '<?xml version="1.0"?><rss version="2.0"><channel><title>Fixture</title><link>http://example.com/</link><description>Fixture</description>'+"".join(items)+"</channel></rss>"
+
+#   \brief - Strips HTML the previous way, compiling the regular expression on every call.
+def per_call_clean_html(raw):
+    clean_regex = re.compile('<.*?>')
+    return re.sub(clean_regex, '', raw)
+
+#   \brief - Ranks a story the previous way, normalising the title and summary again for every term.
+def per_call_rank(terms,entry):
+    rank = 0
+    for term in terms:
+        nopunc_term = re.sub(r'[^\w\s]','',term.lower())
+        nopunc_title = re.sub(r'[^\w\s]','',entry['title'].lower())
+        nopunc_summary = re.sub(r'[^\w\s]','',entry['summary'].lower())
+        test_whole_word = re.compile(r'\b({0})\b'.format(re.escape(nopunc_term)), flags=re.IGNORECASE).search
+        if test_whole_word(nopunc_title):
+            rank += 2
+        if test_whole_word(nopunc_summary):
+            rank += 1
+    return rank
+
+#   \brief - Counts words the previous way, with its own regular expression.
+def per_call_count_words(entry,counts):
+    seen = set()
+    for word in re.sub(r'[^\w\s-]','',entry['title']).split()+re.sub(r'[^\w\s-]','',entry['summary']).split():
+        if word.lower() not in seen:
+            seen.add(word.lower())
+            counts[word] = counts.get(word,0)+1
+
+#   \brief - Ingests the stories and matches them against every issue the previous way.
+def per_call(feed_data,issues):
+    entries = [{'title': entry.title, 'summary': per_call_clean_html(entry.summary), 'link': entry.link} for entry in feed_data.entries]
+    ranks = [[per_call_rank(issues[issue],entry) for entry in entries] for issue in issues]
+    counts = {}
+    for entry in entries:
+        per_call_count_words(entry,counts)
+    return ranks
+
+#   \brief - Ingests the stories, normalising each once, and matches them against every issue reusing the stored forms.
+def normalised_once(feed_data,issues):
+    entries = trunc_entries(feed_data)
+    ranks = []
+    for issue in issues:
+        matcher = get_matcher(issues[issue])
+        ranks.append([matcher.rank(entry) for entry in entries])
+    counts = Counter()
+    for entry in entries:
+        count_words(entry,counts)
+    return ranks
+
+#   \brief - Returns the fastest of several runs of a function, in milliseconds.
+def best_of(function,runs,*args):
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter()-start)
+    return round(min(times)*1000,1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    feed_data = feedparser.parse(fixture_feed(args.stories)) #Parsing takes the same time either way, so it is left out.
+    default_issues = json.load(open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"project","default_issues.json")))
+    issues = {issue: default_issues[issue][0] for issue in default_issues}
+    results = {"stories": args.stories,
+               "issues": len(issues),
+               "per_call_ms": best_of(per_call,args.runs,feed_data,issues),
+               "normalised_once_ms": best_of(normalised_once,args.runs,feed_data,issues)}
+    print(json.dumps(results))
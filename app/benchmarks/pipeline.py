@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import argparse
+import threading
+import statistics
+import subprocess
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#   Measures each stage of a refresh - get_feeds(), archive_json(), read_default_archive(), get_issues(), search_key_phrases() and most_common_phrases() - against synthetic feeds of several sizes.
+
+#   Run from the app directory: python benchmarks/pipeline.py --sizes small medium --output before.json
+#   Compare two runs: python benchmarks/pipeline.py --sizes small medium --compare before.json
+
+#   Feeds are served from a local HTTP server, and each run uses a fresh SQLite database and filesystem sessions in a temporary directory, so no network, database or Redis server is needed. Every stage is timed without tracing, then run once more under tracemalloc for its peak memory, as tracing slows Python down several times over.
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sizes = {"small": {"entries": 100, "outlets": 2, "issues": 5},
+         "medium": {"entries": 10000, "outlets": 20, "issues": 50},
+         "large": {"entries": 100000, "outlets": 200, "issues": 500}} #The number of stories, outlets and tracked issues of each preset.
+feeds_per_outlet = 2
+shared_fraction = 0.1 #The fraction of stories which also appear in another outlet's feed, as wire stories do.
+searches = 20 #The number of searches timed in the search_key_phrases() stage.
+stages = ("get_feeds","archive_json","read_default_archive","get_issues","search_key_phrases","most_common_phrases")
+
+#   \brief - Makes a vocabulary of made-up words, so that word counts and matches behave like real text without depending on any real text.
+
+#   \param rng - The random number generator.
+#   \param size - The number of words.
+
+#   \returns - The list of words.
+
+def make_vocabulary(rng,size=3000):
+    syllables = ["ka","lo","mi","ren","sta","vo","ther","qui","dan","el","por","us","tri","ze","ba","gon"]
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choice(syllables) for i in range(rng.randint(2,4))))
+    return sorted(vocabulary)
+
+#   \brief - Builds the synthetic feeds and tracked issues for one size.
+
+#   Words are picked with a Zipf-like distribution, so a few words are very common, as in real headlines. The same seed always gives the same feeds.
+
+#   \param entries - The total number of stories.
+#   \param outlets - The number of outlets.
+#   \param issues - The number of tracked issues.
+#   \param seed - The seed of the random number generator.
+
+#   \returns feeds - The dictionary of RSS documents, under their path on the server as the key.
+#   \returns issues - The dictionary of tracked issues - each list of tags under the issue name as their key.
+
+def make_fixtures(entries,outlets,issues,seed=0):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    weights = [1/(rank+1) for rank in range(len(vocabulary))]
+    def words(count):
+        return rng.choices(vocabulary, weights=weights, k=count)
+    paths = ["/"+str(outlet)+"/"+str(feed)+".xml" for outlet in range(outlets) for feed in range(feeds_per_outlet)]
+    items = {path: [] for path in paths}
+    for story in range(entries):
+        item = ("<item><title>"+" ".join(words(8)).capitalize()+"</title>"
+                "<description>&lt;p&gt;"+" ".join(words(30))+"&lt;/p&gt;</description>"
+                "<link>http://news.example.com/story/"+str(story)+"?utm_source=rss</link>"
+                "<pubDate>Mon, 03 Oct 2022 12:00:00 GMT</pubDate></item>")
+        items[paths[story%len(paths)]].append(item)
+        if rng.random() < shared_fraction:
+            items[rng.choice(paths)].append(item)
+    feeds = {}
+    for path in paths:
+        feeds[path] = ('<?xml version="1.0"?><rss version="2.0"><channel><title>'+path+'</title><link>http://news.example.com/</link><description>Synthetic</description>'
+                       +"".join(items[path])+"</channel></rss>").encode()
+    tracked_issues = {"Issue "+str(issue): words(3) for issue in range(issues)}
+    return feeds, tracked_issues
+
+#   \brief - Serves the synthetic feeds from a local HTTP server in a background thread.
+
+#   \param feeds - The dictionary of RSS documents, under their path on the server as the key.
+
+#   \returns - The server, whose address is in server_address.
+
+def serve_feeds(feeds):
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = feeds.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type","application/rss+xml")
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self,*args):
+            pass
+    server = ThreadingHTTPServer(("127.0.0.1",0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+#   \brief - Runs every stage once as a new user, so that nothing is left in the archive, index or caches from an earlier run.
+
+#   \param app - The Flask app.
+#   \param user_name - The name of the new user.
+#   \param feeds_list - The dictionary of feed URL lists under the outlet names as keys.
+#   \param issues - The dictionary of tracked issues.
+#   \param trace - True to measure the peak memory of each stage instead of its time.
+
+#   \returns - A dictionary with the seconds or peak bytes of each stage, under the stage name as the key.
+
+def run_stages(app,user_name,feeds_list,issues,trace):
+    from flask import session
+    from flask_login import login_user
+    from project import db, routes, fetch
+    from project.models import User
+    from project.cache import LRUCache
+    results = {}
+    def measure(stage,function,*args):
+        if trace:
+            tracemalloc.start()
+            result = function(*args)
+            results[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            result = function(*args)
+            results[stage] = time.perf_counter()-start
+        return result
+    with app.test_request_context():
+        user = User(name=user_name, password="x")
+        db.session.add(user)
+        db.session.commit()
+        login_user(user)
+        routes.feed_cache = fetch.FeedCache() #Download every feed again.
+        routes.analysis_cache = LRUCache(app.config['ANALYSIS_CACHE_SIZE']) #Match every issue again.
+        session['feeds_list'] = feeds_list
+        session['active_default_feeds'] = {}
+        data = measure("get_feeds",routes.get_feeds,False)
+        measure("archive_json",routes.archive_json,data,routes.archive_path,"rss_data")
+        measure("read_default_archive",routes.read_default_archive,routes.archive_path)
+        index = routes.get_index(data)
+        measure("get_issues",routes.get_issues,issues,index,data)
+        terms = [issues[issue] for issue in sorted(issues)][:searches]
+        measure("search_key_phrases",lambda: [routes.search_key_phrases(tags,index) for tags in terms])
+        blacklist = routes.read_blacklist(routes.blacklist_path)
+        measure("most_common_phrases",routes.most_common_phrases,data,blacklist)
+        stories = len(data['entries'])
+    results["stories"] = stories
+    return results
+
+#   \brief - Benchmarks every stage for one size.
+
+#   \param app - The Flask app.
+#   \param name - The name of the size.
+#   \param size - The number of stories, outlets and issues, as in sizes.
+#   \param runs - The number of timed runs.
+
+#   \returns - The results for the size, with the median and fastest seconds and the peak bytes of each stage.
+
+def benchmark_size(app,name,size,runs):
+    feeds, issues = make_fixtures(size["entries"],size["outlets"],size["issues"])
+    server = serve_feeds(feeds)
+    try:
+        base = "http://127.0.0.1:"+str(server.server_address[1])
+        feeds_list = {}
+        for path in sorted(feeds):
+            feeds_list.setdefault("Outlet "+path.split("/")[1],[]).append(base+path)
+        timings = [run_stages(app,name+"-time-"+str(run),feeds_list,issues,False) for run in range(runs)]
+        memory = run_stages(app,name+"-memory",feeds_list,issues,True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    result = {"size": size, "stories": timings[0]["stories"], "feed_bytes": sum(len(body) for body in feeds.values()), "stages": {}}
+    for stage in stages:
+        seconds = [timing[stage] for timing in timings]
+        result["stages"][stage] = {"median_s": round(statistics.median(seconds),4), "min_s": round(min(seconds),4), "peak_bytes": memory[stage]}
+    return result
+
+#   \brief - Returns the commit the benchmark was run against, so results can be compared across commits.
+
+#   \returns - The commit hash, with "-dirty" appended if there are uncommitted changes, or None outside of a git repository.
+
+def current_commit():
+    try:
+        commit = subprocess.run(["git","rev-parse","HEAD"], cwd=app_dir, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git","status","--porcelain","--untracked-files=no"], cwd=app_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if changes:
+        commit += "-dirty"
+    return commit
+
+#   \brief - Prints the change in each stage's median time and peak memory from an earlier set of results.
+
+#   \param before - The earlier results.
+#   \param after - The new results.
+
+def compare(before,after):
+    for name in after["results"]:
+        if name not in before["results"]:
+            continue
+        print(name+" ("+str(before["commit"])+" -> "+str(after["commit"])+")")
+        for stage in stages:
+            old = before["results"][name]["stages"][stage]
+            new = after["results"][name]["stages"][stage]
+            time_ratio = new["median_s"]/old["median_s"] if old["median_s"] else float("nan")
+            memory_ratio = new["peak_bytes"]/old["peak_bytes"] if old["peak_bytes"] else float("nan")
+            print("  "+stage.ljust(22)+str(old["median_s"]).rjust(9)+" s -> "+str(new["median_s"]).rjust(9)+" s  x"+format(time_ratio,".2f")
+                  +"   "+str(old["peak_bytes"]//1024).rjust(8)+" KiB -> "+str(new["peak_bytes"]//1024).rjust(8)+" KiB  x"+format(memory_ratio,".2f"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", choices=sorted(sizes), default=["small","medium"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="File to save the results to as JSON.")
+    parser.add_argument("--compare", help="Results saved by an earlier run, to compare with.")
+    args = parser.parse_args()
+    sys.path.insert(0,app_dir)
+    output = args.output and os.path.abspath(args.output) #Found before the working directory changes.
+    before = args.compare and os.path.abspath(args.compare)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['SECRET_KEY'] = "benchmark"
+        os.environ['SESSION_TYPE'] = "filesystem"
+        os.environ.setdefault('SESSION_REDIS',"redis://localhost:6379") #Never connected to, as sessions and refresh jobs are kept locally.
+        os.environ['SQLALCHEMY_DATABASE_URI'] = "sqlite:///"+os.path.join(directory,"benchmark.sqlite")
+        os.environ['INGEST_ENABLED'] = "0"
+        os.environ['FEED_CACHE_TTL'] = "0"
+        os.environ['FEED_TIMEOUT'] = "600"
+        os.environ['FEED_DEADLINE'] = "3600" #Large feeds take a long time to parse, and must not be reported as slow.
+        os.chdir(directory) #Sessions are saved under the working directory.
+        from project import create_app
+        app = create_app()
+        app.root_path = directory #Keep the benchmark users' files out of the app directory.
+        results = {"commit": current_commit(), "python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": args.runs, "results": {}}
+        for name in args.sizes:
+            results["results"][name] = benchmark_size(app,name,sizes[name],args.runs)
+            print(name+": "+json.dumps(results["results"][name]["stages"]), file=sys.stderr)
+    if output:
+        with open(output,"w") as output_file:
+            output_file.write(json.dumps(results, indent=4))
+    if before:
+        with open(before,"r") as before_file:
+            compare(json.load(before_file),results)
+    else:
+        print(json.dumps(results))
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+#   Measures how long create_app() takes with many users in the database. Users are added to the same database for each count, smallest first.
+
+#   Run from the app directory: python benchmarks/startup.py --users 10000 100000
+
+#   \brief - Adds users to the database until it holds the given number, then times creating the app against it.
+
+#   \param users - The number of users the database should hold.
+
+#   \returns - The number of seconds create_app() took.
+
+def time_startup(users):
+    from project import create_app, db
+    from project.models import User
+    app = create_app() #Creates the tables.
+    with app.app_context():
+        seeded = User.query.count()
+        db.session.execute(User.__table__.insert(), [{"name": "user"+str(i), "password": "x"} for i in range(seeded,users)])
+        db.session.commit()
+    start = time.perf_counter()
+    create_app()
+    return time.perf_counter()-start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10000,100000])
+    args = parser.parse_args()
+    sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('SECRET_KEY',"benchmark")
+    os.environ.setdefault('SESSION_TYPE',"filesystem")
+    os.environ.setdefault('SESSION_REDIS',"redis://localhost:6379")
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['SESSION_FILE_DIR'] = directory
+        os.environ['SQLALCHEMY_DATABASE_URI'] = "sqlite:///"+os.path.join(directory,"startup.sqlite")
+        for users in sorted(args.users):
+            print(str(users)+" users: "+str(round(time_startup(users)*1000,1))+" ms")
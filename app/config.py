@@ -17,6 +17,55 @@ class Config:
     #Session config
     SESSION_TYPE = environ.get('SESSION_TYPE')
     SESSION_REDIS = redis.from_url(environ.get('SESSION_REDIS'))
+    USER_STORE_SIZE = int(environ.get('USER_STORE_SIZE', 256)) #Number of users whose feed and issue data is held in memory, outside the session.
+    USER_CACHE_SIZE = int(environ.get('USER_CACHE_SIZE', 1024)) #Number of logged in users kept in memory, so loading them does not query the database.
+    USER_CACHE_TTL = float(environ.get('USER_CACHE_TTL', 60)) #Seconds a cached user is served before being loaded from the database again.
+    ANALYSIS_CACHE_SIZE = int(environ.get('ANALYSIS_CACHE_SIZE', 1024)) #Number of issue matches and popular topic lists shared between users with the same feeds.
+    INDEX_CACHE_SIZE = int(environ.get('INDEX_CACHE_SIZE', 64)) #Number of users whose inverted index is held in memory.
+    SEARCH_CACHE_SIZE = int(environ.get('SEARCH_CACHE_SIZE', 1024)) #Number of search results shared between users with the same feeds.
+    SEARCH_PAGE_SIZE = int(environ.get('SEARCH_PAGE_SIZE', 20)) #Number of stories shown on each page of search results.
+    HISTORY_SEARCH_CANDIDATES = int(environ.get('HISTORY_SEARCH_CANDIDATES', 10000)) #Number of most recent matching stories ranked when searching all history.
+    FILE_CACHE_SIZE = int(environ.get('FILE_CACHE_SIZE', 4096)) #Number of users' files whose contents are remembered, so writes which would not change them are skipped.
     
     #Admin config
-    ADMIN_USERS = ['admin']
+    ADMIN_USERS = ['admin'] #Admins while there is no admin_users.json, which otherwise lists every admin.
+    ADMIN_CHECK_INTERVAL = float(environ.get('ADMIN_CHECK_INTERVAL', 5)) #Seconds between checks for changes to admin_users.json.
+    ADMIN_PAGE_SIZE = int(environ.get('ADMIN_PAGE_SIZE', 50)) #Number of users listed on each page of the admin support list.
+    SUPPORT_PAGE_SIZE = int(environ.get('SUPPORT_PAGE_SIZE', 20)) #Number of support messages shown on each page.
+    
+    #Feed fetching config
+    FEED_FETCH_WORKERS = int(environ.get('FEED_FETCH_WORKERS', 8)) #Maximum number of feeds downloaded at once.
+    FEED_TIMEOUT = float(environ.get('FEED_TIMEOUT', 10)) #Seconds to wait for a single feed's server.
+    FEED_DEADLINE = float(environ.get('FEED_DEADLINE', 20)) #Seconds after which a refresh gives up on unfinished feeds.
+    ARCHIVE_RETENTION = int(environ.get('ARCHIVE_RETENTION', 50)) #Number of snapshots kept in each user's archive, or 0 to keep them all.
+    TREND_RETENTION_DAYS = int(environ.get('TREND_RETENTION_DAYS', 365)) #Days the issue, outlet and popular topic counts of each snapshot are kept for the trends page, or 0 to keep them all.
+    FEED_CACHE_SIZE = int(environ.get('FEED_CACHE_SIZE', 1024)) #Maximum number of parsed feeds held in each process's feed cache.
+    FEED_CACHE_TTL = float(environ.get('FEED_CACHE_TTL', 300)) #Seconds a fetched feed is shared between users before being revalidated.
+    
+    #Background ingestion config
+    INGEST_ENABLED = environ.get('INGEST_ENABLED', '0') == '1' #Poll every tracked feed in the background instead of when users refresh - in one separate process (ingest.py) with a Redis shared store, or in a thread of the only process otherwise.
+    FEED_POLL_INTERVAL = float(environ.get('FEED_POLL_INTERVAL', 600)) #Default seconds between polls of each feed.
+    FEED_MAX_BACKOFF = float(environ.get('FEED_MAX_BACKOFF', 3600)) #Maximum seconds between polls of a failing feed.
+    
+    #Profiling config
+    PROFILE_REQUESTS = environ.get('PROFILE_REQUESTS', '0') == '1' #Profile every request with cProfile. Slows requests down, so only for diagnosing slow pages.
+    PROFILE_DIR = environ.get('PROFILE_DIR') #Directory the profile of each request is saved to, or unset to print them to the log.
+    PROFILE_RESTRICTIONS = int(environ.get('PROFILE_RESTRICTIONS', 30)) #Number of the slowest functions shown when printing each profile.
+    METRICS_FLUSH_INTERVAL = float(environ.get('METRICS_FLUSH_INTERVAL', 1)) #Most seconds each process holds the metrics it records before adding them to the totals in Redis, with the Redis shared store. Without it, the metrics page only reports the worker process which serves it.
+    
+    #Refresh job config
+    SHARED_STORE = environ.get('SHARED_STORE', 'redis' if environ.get('SESSION_TYPE') == 'redis' else 'memory') #Where feeds ingested in the background are kept: "redis" to share them between worker processes and the ingester, or "memory" for a single process.
+    JOB_STORE = environ.get('JOB_STORE', 'redis' if environ.get('SESSION_TYPE') == 'redis' else 'memory') #Where refresh progress is kept: "redis" to share it between worker processes, or "memory" for a single process.
+    REFRESH_WORKERS = int(environ.get('REFRESH_WORKERS', 4)) #Number of refreshes run at once in each worker process.
+    REFRESH_JOB_TIMEOUT = float(environ.get('REFRESH_JOB_TIMEOUT', 300)) #Seconds the progress of each user's latest refresh is kept in Redis.
+    REFRESH_CLAIM_LEASE = float(environ.get('REFRESH_CLAIM_LEASE', 30)) #Seconds after which a refresh whose worker process died, eg. because it was killed by a timeout, no longer blocks new ones and is reported as interrupted. Running refreshes renew their claim every third of this.
+    
+    #Web server config, read by gunicorn.conf.py
+    WEB_BIND = environ.get('WEB_BIND', '0.0.0.0:5000') #Address and port the server listens on.
+    WEB_WORKERS = int(environ.get('WEB_WORKERS', 4)) #Number of worker processes.
+    WEB_THREADS = int(environ.get('WEB_THREADS', 4)) #Number of request threads in each worker process.
+    WEB_TIMEOUT = int(environ.get('WEB_TIMEOUT', 60)) #Seconds a request may take before its worker is restarted. Should be longer than FEED_DEADLINE.
+    WEB_GRACEFUL_TIMEOUT = int(environ.get('WEB_GRACEFUL_TIMEOUT', 30)) #Seconds workers are given to finish their requests when restarting.
+    WEB_KEEPALIVE = int(environ.get('WEB_KEEPALIVE', 5)) #Seconds to keep idle connections open.
+    WEB_MAX_REQUESTS = int(environ.get('WEB_MAX_REQUESTS', 1000)) #Number of requests after which a worker is gracefully replaced, or 0 to never replace workers.
+    WEB_MAX_REQUESTS_JITTER = int(environ.get('WEB_MAX_REQUESTS_JITTER', 100)) #Random extra requests per worker, so workers are not all replaced at once.
@@ -0,0 +1,38 @@
+import os
+import sys
+import subprocess
+from config import Config
+
+#   Production server settings, used with: gunicorn --config gunicorn.conf.py wsgi:app
+
+#   Each worker is a separate process with its own threads. The app is created once in the master process and then forked, so workers start quickly and share memory until they write to it. Anything which cannot be shared between processes, such as database connections and background threads, is only opened once a worker is running.
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = "gthread" #Threads let a worker keep serving other users while a request waits on a slow feed.
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+keepalive = Config.WEB_KEEPALIVE
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS_JITTER
+preload_app = True
+accesslog = "-"
+
+#   \brief - Starts the feed ingester in its own process once the workers are ready, so that each feed is polled once rather than once per worker.
+
+#   \param server - The gunicorn arbiter.
+
+def when_ready(server):
+    if Config.INGEST_ENABLED and Config.SHARED_STORE == "redis":
+        server.ingester = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),"ingest.py")])
+
+#   \brief - Stops the feed ingester when gunicorn shuts down.
+
+#   \param server - The gunicorn arbiter.
+
+def on_exit(server):
+    ingester = getattr(server,"ingester",None)
+    if ingester is not None:
+        ingester.terminate()
+        ingester.wait(timeout=Config.WEB_GRACEFUL_TIMEOUT)
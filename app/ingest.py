@@ -0,0 +1,8 @@
+from project import create_app, start_ingester
+
+#   Polls every tracked feed into the shared feed cache in Redis, so that feeds are polled once however many worker processes serve requests. Started by gunicorn.conf.py when INGEST_ENABLED is set, or run on its own with: python ingest.py
+
+app = create_app()
+
+if __name__ == "__main__":
+    start_ingester(app).join()
@@ -1,3 +1,5 @@
+import os
+import threading
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -8,6 +10,7 @@ from flask_admin import Admin, BaseView, expose
 db = SQLAlchemy()
 login_manager = LoginManager()
 sess = Session()
+ingester_lock = threading.Lock()
 
 
 #   \brief - Construct the core application.
@@ -21,22 +24,68 @@ def create_app():
     login_manager.init_app(app)
     sess.init_app(app)
 
+    #Time loading and saving the session, which deserialises and serialises it on every request
+    from .metrics import metrics
+    app.session_interface.open_session = metrics.timed("stage_seconds",stage="open_session")(app.session_interface.open_session)
+    app.session_interface.save_session = metrics.timed("stage_seconds",stage="save_session")(app.session_interface.save_session)
+    if app.config['SHARED_STORE'] == "redis":
+        metrics.share(app.config['SESSION_REDIS'],app.config['METRICS_FLUSH_INTERVAL']) #Report the totals of every worker process and the ingester, rather than only the worker which serves the metrics page.
+
+    #Profile every request, if enabled
+    if app.config['PROFILE_REQUESTS']:
+        from werkzeug.middleware.profiler import ProfilerMiddleware
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[app.config['PROFILE_RESTRICTIONS']], profile_dir=app.config['PROFILE_DIR'])
+
     with app.app_context():
         #Import parts of the application
         from . import routes
         from . import auth
-        from .admin_views import SupportView, SupportList
-        from .models import User
+        from .admin_views import SupportView, SupportList, FeedCacheView, MetricsView
         app.register_blueprint(routes.main_bp)
         app.register_blueprint(auth.auth_bp)
         admin = Admin(app)
         #Initialize global database
         db.create_all()
+        routes.import_legacy_support(os.path.join(app.root_path,"users")) #Move support messages kept in files by earlier versions into the database.
         
         #Add admin views
         admin.add_view(SupportList(name='View all queries'))
-        users = User.query.all()
-        for user in users:
-            admin.add_view(SupportView(name=user.name, endpoint=str(user.id), category='Support users'))
+        admin.add_view(FeedCacheView(name='Feed cache'))
+        admin.add_view(MetricsView(name='Metrics', endpoint='metrics'))
+        admin.add_view(SupportView(name='Support users', endpoint='support_users')) #Users are looked up when a page is requested, so startup does not depend on the number of users.
+
+        #Close the connections opened at startup, so that workers forked from this process never share them
+        db.engine.dispose()
+
+        #Start polling tracked feeds in the background once the process serving requests is running. With a shared store, feeds are polled by ingest.py instead, so that they are only polled once however many worker processes there are
+        if app.config['INGEST_ENABLED'] and app.config['SHARED_STORE'] != "redis":
+            @app.before_request
+            def ensure_ingester():
+                start_ingester(app) #Returns nothing, since a before_request function which returns a value replaces the response.
 
         return app
+
+
+#   \brief - Starts the feed ingestion thread, if it is not already running in this process.
+
+#   Threads do not survive a fork, so the thread is started from the first request each worker process serves rather than when the app is created, or by ingest.py in its own process.
+
+#   \param app - The application.
+
+#   \returns - The ingestion thread.
+
+def start_ingester(app):
+    ingester = app.extensions.get('ingester')
+    if ingester is not None and ingester.pid == os.getpid():
+        return ingester
+    with ingester_lock:
+        ingester = app.extensions.get('ingester')
+        if ingester is not None and ingester.pid == os.getpid():
+            return ingester
+        from . import routes
+        from .ingest import Ingester
+        users_root = os.path.join(app.root_path,"users")
+        ingester = Ingester(routes.feed_cache,lambda: routes.tracked_feeds(users_root,app.config['FEED_POLL_INTERVAL']),app.config['FEED_POLL_INTERVAL'],app.config['FEED_MAX_BACKOFF'],app.config['FEED_FETCH_WORKERS'],app.config['FEED_TIMEOUT'],app.config['FEED_DEADLINE'])
+        ingester.start()
+        app.extensions['ingester'] = ingester
+        return ingester
@@ -1,17 +1,55 @@
 import os
-from datetime import datetime
-from flask import redirect, render_template, Blueprint, request, session, url_for
+import time
+import threading
+from flask import redirect, render_template, Blueprint, request, url_for, Response
 from flask_login import current_user
 from flask import current_app as app
 from flask_admin import Admin, BaseView, expose
-from .models import db, User
-from .routes import read_json, write_json
+from .models import db, User, Message, Alert
+from .routes import read_json, message_page, message_date_format, feed_cache
+from .metrics import metrics
+
+#   \brief - The set of admin usernames, kept in memory and reread only when admin_users.json changes.
+
+#   The file's modification time is checked at most once every check_interval seconds, so most admin requests do not touch the disk at all, while changes to the file still take effect without a restart. The usernames in Config.ADMIN_USERS are only used while there is no admin_users.json, so removing a user from the file always removes their access.
+
+class AdminUsers:
+
+#   \brief - Creates the cache, without reading the file yet.
+
+#   \param path - The path to the JSON file listing the admin usernames.
+#   \param configured - The list of admin usernames used while the file does not exist.
+#   \param check_interval - The number of seconds between checks of the file's modification time.
+
+    def __init__(self,path,configured,check_interval):
+        self.lock = threading.Lock()
+        self.path = path
+        self.configured = frozenset(configured)
+        self.check_interval = check_interval
+        self.users = self.configured
+        self.mtime = None
+        self.checked = None
+
+#   \brief - Returns the set of admin usernames, rereading the file if it has changed since it was last read.
+    def get(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is None or now-self.checked >= self.check_interval:
+                self.checked = now
+                try:
+                    mtime = os.path.getmtime(self.path)
+                except FileNotFoundError:
+                    mtime = None
+                if mtime != self.mtime:
+                    self.mtime = mtime
+                    self.users = self.configured if mtime is None else frozenset(read_json(self.path,False,False))
+            return self.users
+
+admin_users = AdminUsers(os.path.join(app.root_path,"admin_users.json"),app.config['ADMIN_USERS'],app.config['ADMIN_CHECK_INTERVAL'])
 
 class SecuredBaseView(BaseView):
     def is_accessible(self):
-        admin_json_path = os.path.join(app.root_path,"admin_users.json")
-        admin_users = read_json(admin_json_path,False,False)
-        return current_user.name in admin_users
+        return current_user.is_authenticated and current_user.name in admin_users.get()
 
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for('auth_bp.login_page', next=request.url))
@@ -19,22 +57,48 @@ class SecuredBaseView(BaseView):
 class SupportList(SecuredBaseView):
     @expose('/')
     def support_list(self):
-        all_messages=read_json(os.path.join(app.root_path,"all_messages.json"))
-        return self.render('support_list.html',messages=all_messages)
+        messages, next_before = message_page(Message.query,request.args.get('before',type=int),app.config['SUPPORT_PAGE_SIZE'])
+        return self.render('support_list.html', messages=messages, next_before=next_before, date_format=message_date_format)
+
+class FeedCacheView(SecuredBaseView):
+    @expose('/')
+    def feed_cache_stats(self):
+        return self.render('feed_cache.html',stats=feed_cache.stats())
+
+#   \brief - Shows the timings and counters in the Prometheus text format, for scraping. With the Redis shared store these are the totals of every process, otherwise only those of the worker process which serves the page.
+
+class MetricsView(SecuredBaseView):
+    @expose('/')
+    def metrics_page(self):
+        stats = feed_cache.stats()
+        extra = [("feed_cache_hits_total","counter","Feeds served from the feed cache without contacting their server.",stats['hits']),
+                 ("feed_cache_misses_total","counter","Feeds downloaded because they were not in the feed cache.",stats['misses']),
+                 ("feed_cache_revalidations_total","counter","Cached feeds which their server confirmed had not changed.",stats['revalidations']),
+                 ("feed_cache_feeds","gauge","Feeds held in the feed cache.",stats['feeds'])]
+        return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+#   \brief - A single admin view for supporting any user, which looks the user up from the URL when a page is requested.
+
+#   Users who sign up after the app has started can be supported straight away, and the app no longer creates a view for every user when it starts.
 
 class SupportView(SecuredBaseView):
-    @expose('/', methods=['GET','POST'])
-    def support(self):
-        messages_path = os.path.join(app.root_path,"users",self.endpoint,"messages.json")
-        alerts_path = os.path.join(app.root_path,"users",self.endpoint,"alerts.json")
-        session['target_messages'] = read_json(messages_path,False,False)
+
+#   \brief - Lists the users who can be supported, a page at a time in order of their id.
+    @expose('/')
+    def user_list(self):
+        page = request.args.get('page',1,type=int)
+        users = User.query.order_by(User.id).paginate(page=page, per_page=app.config['ADMIN_PAGE_SIZE'], error_out=False)
+        return self.render('support_users.html', users=users)
+
+#   \brief - Shows a user's support messages and lets an admin reply to them.
+    @expose('/<int:user_id>', methods=['GET','POST'])
+    def support(self,user_id):
+        user = User.query.get_or_404(user_id)
         if request.method == "POST":
             new_message = request.form['send_msg']
             if new_message != "":
-                ts = datetime.now()
-                session['target_messages'].insert(0,{"sender":current_user.name,"date":ts.strftime("%B %d, %Y at %H:%M:%S"), "message":new_message})
-                write_json(session['target_messages'],messages_path,False)
-                target_alerts = read_json(alerts_path,False,False)
-                target_alerts.insert(0,"New response from "+current_user.name+" to your support query.")
-                write_json(target_alerts,alerts_path,False)
-        return self.render('support_messaging_admin.html', current_user = current_user.name, messages=session['target_messages'], customer = self.name, endpoint = self.endpoint)
+                db.session.add(Message(user_id=user.id, sender=current_user.name, message=new_message))
+                db.session.add(Alert(user_id=user.id, alert="New response from "+current_user.name+" to your support query."))
+                db.session.commit()
+        messages, next_before = message_page(Message.query.filter_by(user_id=user.id),request.args.get('before',type=int),app.config['SUPPORT_PAGE_SIZE'])
+        return self.render('support_messaging_admin.html', current_user = current_user.name, messages=messages, next_before=next_before, date_format=message_date_format, customer = user.name, user_id = user.id)
@@ -0,0 +1,351 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+#   The archive is a SQLite database per user. Each story is stored once, keyed by its canonical link along with the link it was published under, and each snapshot only stores which stories it contained and where.
+
+#   Every story ever archived is also kept in the history table, which is never pruned, along with a full-text index over its title and summary so that the whole history can be searched without reading it into memory. The full-text index uses SQLite's FTS5 extension; if SQLite was built without it, history is searched by scanning instead.
+
+#   Each snapshot also gets a rollup of the number of stories matching each tracked issue, the number of stories from each outlet and its most common words. Rollups are kept after their snapshot is pruned, so trends can be shown over a much longer time than the raw snapshots are kept for, without reading any stories.
+
+#   The user's inverted index (see index.py) is kept in the index_ tables, so that it can be saved a few rows at a time rather than rewritten whole.
+
+schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    link TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    published TEXT NOT NULL,
+    url TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_entries (
+    snapshot_id INTEGER NOT NULL,
+    outlet_position INTEGER NOT NULL,
+    outlet TEXT NOT NULL,
+    feed INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshot_entries_snapshot ON snapshot_entries (snapshot_id, outlet_position, feed, position);
+CREATE INDEX IF NOT EXISTS snapshot_entries_entry ON snapshot_entries (entry_id);
+CREATE TABLE IF NOT EXISTS rollups (
+    snapshot_id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    stories INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_counts (
+    snapshot_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rollups_created ON rollups (created);
+CREATE INDEX IF NOT EXISTS rollup_counts_snapshot ON rollup_counts (snapshot_id, kind);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    link TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    published TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    url TEXT
+);
+CREATE TABLE IF NOT EXISTS index_docs (
+    id INTEGER PRIMARY KEY,
+    link TEXT NOT NULL,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    published TEXT NOT NULL,
+    normalised_title TEXT NOT NULL,
+    normalised_summary TEXT NOT NULL,
+    url TEXT
+);
+CREATE TABLE IF NOT EXISTS index_current (
+    outlet_position INTEGER NOT NULL,
+    outlet TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS index_issues (
+    name TEXT PRIMARY KEY,
+    tags TEXT NOT NULL,
+    matched INTEGER NOT NULL,
+    ranks TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS index_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+history_fts_schema = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5 (title, summary, content='history', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS history_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, title, summary) VALUES (new.id, new.title, new.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS history_update AFTER UPDATE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, title, summary) VALUES ('delete', old.id, old.title, old.summary);
+    INSERT INTO history_fts (rowid, title, summary) VALUES (new.id, new.title, new.summary);
+END;
+"""
+
+rollup_kinds = ("issue","outlet","word") #The kinds of counts kept in each rollup.
+initialised_paths = set() #The archive databases whose tables this process has already created or checked.
+
+#   \brief - Opens the archive database, creating its tables if they do not exist yet.
+
+#   The tables are only created or checked the first time this process opens each database, as connect() is called several times by every refresh and search.
+
+#   \param db_path - The path to the archive database.
+
+#   \returns - The database connection.
+
+def connect(db_path):
+    if db_path in initialised_paths and os.path.exists(db_path): #A database which has since been deleted is created again.
+        return sqlite3.connect(db_path, timeout=30)
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL") #Only takes effect when the database is created, letting pruned pages be given back to the file system.
+    connection.execute("PRAGMA journal_mode = WAL") #Lets logins read the archive while a refresh is writing to it.
+    connection.executescript(schema)
+    try:
+        connection.executescript(history_fts_schema)
+    except sqlite3.OperationalError: #SQLite was built without FTS5.
+        pass
+    if connection.execute("PRAGMA user_version").fetchone()[0] < 1: #Archives from before the history table was added.
+        with connection:
+            connection.execute("INSERT OR IGNORE INTO history (link, title, summary, published, first_seen) "
+                               "SELECT entries.link, entries.title, entries.summary, entries.published, MIN(snapshots.created) FROM entries "
+                               "JOIN snapshot_entries ON snapshot_entries.entry_id = entries.id JOIN snapshots ON snapshots.id = snapshot_entries.snapshot_id "
+                               "GROUP BY entries.id")
+            connection.execute("PRAGMA user_version = 1")
+    if connection.execute("PRAGMA user_version").fetchone()[0] < 2: #Archives from before stories kept the link they were published under.
+        with connection:
+            for table in ("entries","history","index_docs"):
+                if "url" not in [column[1] for column in connection.execute("PRAGMA table_info("+table+")")]:
+                    connection.execute("ALTER TABLE "+table+" ADD COLUMN url TEXT")
+            connection.execute("PRAGMA user_version = 2")
+    initialised_paths.add(db_path)
+    return connection
+
+#   \brief - Returns whether the archive has a full-text index over its history.
+
+#   \param connection - The database connection.
+
+#   \returns - True if the history_fts table exists.
+
+def has_fts(connection):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone() is not None
+
+#   \brief - Appends a snapshot of the RSS data to the archive, then prunes snapshots beyond the retention limit.
+
+#   Stories already in the archive are not stored again. A story whose title, summary or publication date has changed is updated in place.
+
+#   \param db_path - The path to the archive database.
+#   \param data - The data dictionary containing the RSS data, as built by pipeline.build_snapshot().
+#   \param prefix - The prefix describing the snapshot - eg. "rss_data".
+#   \param retention - The number of most recent snapshots to keep, or 0 to keep every snapshot.
+
+#   \returns - The id of the new snapshot.
+
+def write_snapshot(db_path,data,prefix,retention=0):
+    connection = connect(db_path)
+    try:
+        with connection:
+            created = datetime.now().isoformat(timespec="seconds")
+            cursor = connection.execute("INSERT INTO snapshots (prefix, created) VALUES (?, ?)", (prefix, created))
+            snapshot_id = cursor.lastrowid
+            entry_ids = {}
+            rows = []
+            for outlet_position, outlet in enumerate(data['outlets']):
+                for feed_position, feed in enumerate(data['outlets'][outlet]):
+                    for position, link in enumerate(feed):
+                        entry_id = entry_ids.get(link)
+                        if entry_id is None:
+                            entry = data['entries'][link]
+                            cursor = connection.execute("INSERT INTO entries (link, title, summary, published, url) VALUES (?, ?, ?, ?, ?) "
+                                                        "ON CONFLICT (link) DO UPDATE SET title = excluded.title, summary = excluded.summary, published = excluded.published, url = excluded.url "
+                                                        "WHERE title != excluded.title OR summary != excluded.summary OR published != excluded.published OR url IS NOT excluded.url",
+                                                        (entry['link'], entry['title'], entry['summary'], entry['published'], entry.get('url')))
+                            if cursor.rowcount: #Only new or changed stories need adding to the history, and so to its full-text index.
+                                connection.execute("INSERT INTO history (link, title, summary, published, first_seen, url) VALUES (?, ?, ?, ?, ?, ?) "
+                                                   "ON CONFLICT (link) DO UPDATE SET title = excluded.title, summary = excluded.summary, published = excluded.published, url = excluded.url "
+                                                   "WHERE title != excluded.title OR summary != excluded.summary OR published != excluded.published OR url IS NOT excluded.url",
+                                                   (entry['link'], entry['title'], entry['summary'], entry['published'], created, entry.get('url')))
+                            entry_id = connection.execute("SELECT id FROM entries WHERE link = ?", (entry['link'],)).fetchone()[0]
+                            entry_ids[entry['link']] = entry_id
+                        rows.append((snapshot_id, outlet_position, outlet, feed_position, position, entry_id))
+            connection.executemany("INSERT INTO snapshot_entries (snapshot_id, outlet_position, outlet, feed, position, entry_id) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if retention > 0:
+                prune(connection,retention)
+        connection.execute("PRAGMA incremental_vacuum")
+    finally:
+        connection.close()
+    return snapshot_id
+
+#   \brief - Removes all but the most recent snapshots, along with any stories no longer in a snapshot.
+
+#   \param connection - The database connection.
+#   \param retention - The number of most recent snapshots to keep.
+
+def prune(connection,retention):
+    old_snapshots = [row[0] for row in connection.execute("SELECT id FROM snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (retention,))]
+    if not old_snapshots:
+        return
+    connection.executemany("DELETE FROM snapshot_entries WHERE snapshot_id = ?", [(snapshot_id,) for snapshot_id in old_snapshots])
+    connection.executemany("DELETE FROM snapshots WHERE id = ?", [(snapshot_id,) for snapshot_id in old_snapshots])
+    connection.execute("DELETE FROM entries WHERE NOT EXISTS (SELECT 1 FROM snapshot_entries WHERE entry_id = entries.id)")
+
+#   \brief - Returns the link of every story in a snapshot still kept in the archive.
+
+#   \param db_path - The path to the archive database.
+
+#   \returns - The set of links.
+
+def read_links(db_path):
+    connection = connect(db_path)
+    try:
+        links = {row[0] for row in connection.execute("SELECT link FROM entries")}
+    finally:
+        connection.close()
+    return links
+
+#   \brief - Reads a snapshot from the archive back into a data dictionary.
+
+#   \param db_path - The path to the archive database.
+#   \param snapshot_id - The id of the snapshot, or None for the most recent snapshot.
+
+#   \returns - The data dictionary containing the RSS data, or None if there is no such snapshot.
+
+def read_snapshot(db_path,snapshot_id=None):
+    connection = connect(db_path)
+    try:
+        if snapshot_id is None:
+            row = connection.execute("SELECT MAX(id) FROM snapshots").fetchone()
+            snapshot_id = row[0]
+            if snapshot_id is None:
+                return None
+        rows = connection.execute("SELECT snapshot_entries.outlet, snapshot_entries.feed, entries.title, entries.summary, entries.link, entries.published, entries.url "
+                                  "FROM snapshot_entries JOIN entries ON entries.id = snapshot_entries.entry_id "
+                                  "WHERE snapshot_entries.snapshot_id = ? "
+                                  "ORDER BY snapshot_entries.outlet_position, snapshot_entries.feed, snapshot_entries.position", (snapshot_id,))
+        data = {'entries': {}, 'outlets': {}}
+        for outlet, feed, title, summary, link, published, url in rows:
+            feeds = data['outlets'].setdefault(outlet,[])
+            while len(feeds) <= feed:
+                feeds.append([])
+            feeds[feed].append(link)
+            if link not in data['entries']:
+                data['entries'][link] = {'title': title, 'summary': summary, 'link': link, 'published': published, 'url': url or link} #Stories archived before their published link was kept only have the canonical one.
+    finally:
+        connection.close()
+    return data
+
+#   \brief - Saves the rollup of a snapshot, then removes rollups older than the retention period.
+
+#   \param db_path - The path to the archive database.
+#   \param snapshot_id - The id of the snapshot, as returned by write_snapshot().
+#   \param stories - The number of stories in the snapshot.
+#   \param counts - A dictionary with a dictionary for each kind in rollup_kinds, holding the count under each name as the key.
+#   \param retention_days - The number of days rollups are kept for, or 0 to keep every rollup.
+
+def write_rollup(db_path,snapshot_id,stories,counts,retention_days=0):
+    connection = connect(db_path)
+    try:
+        with connection:
+            row = connection.execute("SELECT created FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            created = row[0] if row is not None else datetime.now().isoformat(timespec="seconds")
+            connection.execute("INSERT OR REPLACE INTO rollups (snapshot_id, created, stories) VALUES (?, ?, ?)", (snapshot_id, created, stories))
+            connection.execute("DELETE FROM rollup_counts WHERE snapshot_id = ?", (snapshot_id,))
+            connection.executemany("INSERT INTO rollup_counts (snapshot_id, kind, name, count) VALUES (?, ?, ?, ?)",
+                                   [(snapshot_id, kind, name, count) for kind in rollup_kinds for name, count in counts.get(kind,{}).items()])
+            if retention_days > 0:
+                cutoff = (datetime.now()-timedelta(days=retention_days)).isoformat(timespec="seconds")
+                connection.execute("DELETE FROM rollup_counts WHERE snapshot_id IN (SELECT snapshot_id FROM rollups WHERE created < ?)", (cutoff,))
+                connection.execute("DELETE FROM rollups WHERE created < ?", (cutoff,))
+    finally:
+        connection.close()
+
+#   \brief - Reads the rollups of the snapshots taken within a time range, as a time series for each name.
+
+#   \param db_path - The path to the archive database.
+#   \param kind - One of rollup_kinds.
+#   \param start - The earliest time to include, as an ISO 8601 string, or None for no limit.
+#   \param end - The latest time to include, as an ISO 8601 string, or None for no limit.
+#   \param names - The list of names to include, or None for every name.
+
+#   \returns snapshots - The list of snapshots in the range, oldest first, each as a dictionary with its 'created' time and number of 'stories'.
+#   \returns series - A list of counts for each name, under the name as the key, with a count for each snapshot in the same order. Snapshots without a count for a name, eg. because a word was not among the most common words, count as 0.
+
+def read_trends(db_path,kind,start=None,end=None,names=None):
+    connection = connect(db_path)
+    try:
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append("created >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("created <= ?")
+            parameters.append(end)
+        where = " WHERE "+" AND ".join(conditions) if conditions else ""
+        snapshots = connection.execute("SELECT snapshot_id, created, stories FROM rollups"+where+" ORDER BY created, snapshot_id", parameters).fetchall()
+        positions = {snapshot_id: position for position, (snapshot_id, created, stories) in enumerate(snapshots)}
+        series = {}
+        if names is not None:
+            for name in names:
+                series[name] = [0]*len(snapshots)
+        if snapshots:
+            rows = connection.execute("SELECT rollup_counts.snapshot_id, rollup_counts.name, rollup_counts.count FROM rollup_counts "
+                                      "JOIN rollups ON rollups.snapshot_id = rollup_counts.snapshot_id"+where.replace("created","rollups.created")+
+                                      (" AND " if where else " WHERE ")+"rollup_counts.kind = ?", parameters+[kind])
+            for snapshot_id, name, count in rows:
+                if names is not None and name not in series:
+                    continue
+                series.setdefault(name,[0]*len(snapshots))[positions[snapshot_id]] = count
+    finally:
+        connection.close()
+    return [{'created': created, 'stories': stories} for snapshot_id, created, stories in snapshots], series
+
+#   \brief - Searches every story ever archived for any of the given words, a page at a time.
+
+#   With FTS5, stories are ranked by BM25, with words in the title counting twice as much as words in the summary, and only the requested page is read. Ranking has to score every matching story, so only the most recent candidates matching stories are ranked; this keeps searches for very common words as fast with millions of stories as with thousands. Without FTS5, the history is scanned for stories containing any of the words, newest first. Either way the memory used depends on the page size rather than on the size of the history.
+
+#   \param db_path - The path to the archive database.
+#   \param words - The list of normalised words to search for.
+#   \param page - The number of the page of results, starting from 1.
+#   \param page_size - The number of stories on each page.
+#   \param candidates - The number of most recent matching stories which are ranked.
+
+#   \returns entries - The list of stories on the page, each as a dictionary with its title, summary, link, publication date and the time it was first archived.
+#   \returns has_next - True if there is another page of results.
+
+def search_history(db_path,words,page,page_size,candidates):
+    words = [word for word in words if word]
+    if not words:
+        return [], False
+    connection = connect(db_path)
+    try:
+        if has_fts(connection):
+            query = " OR ".join('"'+word.replace('"','""')+'"' for word in words) #Quote each word, so that words such as "and" or "near" are not read as operators.
+            rows = connection.execute("SELECT history.title, history.summary, history.link, history.published, history.first_seen, history.url FROM history_fts "
+                                      "JOIN history ON history.id = history_fts.rowid WHERE history_fts MATCH ? "
+                                      "AND history_fts.rowid >= (SELECT MIN(rowid) FROM (SELECT rowid FROM history_fts WHERE history_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) " #Stories are numbered in the order they were archived.
+                                      "ORDER BY bm25(history_fts, 2.0, 1.0) LIMIT ? OFFSET ?", (query, query, candidates, page_size+1, (page-1)*page_size)).fetchall()
+        else:
+            conditions = " OR ".join("title LIKE ? ESCAPE '\\' OR summary LIKE ? ESCAPE '\\'" for word in words)
+            patterns = []
+            for word in words:
+                pattern = "%"+word.replace("\\","\\\\").replace("%","\\%").replace("_","\\_")+"%"
+                patterns += [pattern, pattern]
+            rows = connection.execute("SELECT title, summary, link, published, first_seen, url FROM history WHERE "+conditions+" "
+                                      "ORDER BY id DESC LIMIT ? OFFSET ?", patterns+[page_size+1, (page-1)*page_size]).fetchall()
+    finally:
+        connection.close()
+    entries = [{'title': title, 'summary': summary, 'link': link, 'published': published, 'first_seen': first_seen, 'url': url or link} for title, summary, link, published, first_seen, url in rows[:page_size]]
+    return entries, len(rows) > page_size
@@ -1,12 +1,14 @@
 import os
-from flask import redirect, render_template, flash, Blueprint, request, session, url_for
+from flask import redirect, flash, Blueprint, request, session, url_for
 from flask_login import login_required, logout_user, current_user, login_user
 from flask import current_app as app
 from werkzeug.security import generate_password_hash, check_password_hash
 from .forms import LoginForm, SignupForm
 from .models import db, User
+from .metrics import render_template
 from . import login_manager
-from .routes import create_defaults, flash_form_errors, basic_load
+from .routes import create_defaults, flash_form_errors, basic_load, user_cache, user_stamps, forget_user
+from sqlalchemy.orm import make_transient_to_detached
 
 #Blueprint configuration.
 auth_bp = Blueprint('auth_bp', __name__ ,
@@ -33,6 +35,7 @@ def signup_page():
                             password=generate_password_hash(password, method='sha256'))
                 db.session.add(user)
                 db.session.commit()
+                forget_user(user.id) #Never serve a cached user who previously had this id.
                 login_user(user)
                 create_defaults()
                 basic_load()
@@ -84,11 +87,27 @@ def logout_page():
     logout_user()
     return redirect(url_for('main_bp.home'))
 
+#   \brief - Returns a detached copy of a user, which can be kept between requests without being tied to a database session.
+def detached_copy(user):
+    copy = User(**{column.key: getattr(user,column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
 #   \brief - Checks if the user is logged in.
+
+#   Recently loaded users are served from user_cache, attached to the request's database session without querying the database. Entries expire after USER_CACHE_TTL seconds, and are only served while the user's credential stamp is the one they were cached under, so a change to their username or password in any worker process is seen by every other.
 @login_manager.user_loader
 def load_user(user_id):
     if user_id is not None:
-        return User.query.get(user_id)
+        user_id = int(user_id)
+        stamp = user_stamps.get(user_id) #Read before the database, so that a change committed while loading is not cached under the new stamp.
+        cached = user_cache.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            return db.session.merge(cached[1], load=False) #Gives this request its own instance, leaving the cached copy untouched.
+        user = db.session.get(User,user_id)
+        if user is not None:
+            user_cache.put(user_id,(stamp,detached_copy(user)))
+        return user
     return None
 
 #   \brief - Redirects users who are not logged in to the login page.
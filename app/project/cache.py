@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+
+#   \brief - A thread-safe, in-process cache which evicts the least recently used item once it holds more than max_size items.
+
+#   Items can optionally expire ttl seconds after they were saved.
+
+class LRUCache:
+
+#   \brief - Creates an empty cache.
+
+#   \param max_size - The maximum number of items held.
+#   \param ttl - The number of seconds after which an item expires, or None if items never expire.
+
+    def __init__(self,max_size,ttl=None):
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+
+#   \brief - Returns the item saved under a key, or default if there is no such item or it has expired.
+    def get(self,key,default=None):
+        with self.lock:
+            try:
+                saved, value = self.items[key]
+            except KeyError:
+                return default
+            if self.ttl is not None and time.time()-saved > self.ttl:
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+#   \brief - Saves an item under a key, evicting the least recently used items if the cache is full.
+    def put(self,key,value):
+        with self.lock:
+            self.items[key] = (time.time(), value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+#   \brief - Removes the item saved under a key, if there is one.
+    def pop(self,key):
+        with self.lock:
+            self.items.pop(key,None)
+
+#   \brief - Returns the number of items held.
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+#   Counters let processes tell each other that something they cache has changed: whoever changes it advances its counter, and every process compares the counter with the one its copy was cached under. The Redis counters are shared by every worker process; the memory counters only work within a single process.
+
+#   \brief - Keeps counters in Redis, shared by every worker process.
+
+class RedisCounters:
+
+#   \brief - Creates the counters.
+
+#   \param client - The Redis client.
+#   \param prefix - The prefix of the Redis key of each counter.
+
+    def __init__(self,client,prefix):
+        self.client = client
+        self.prefix = prefix
+
+#   \brief - Returns the value of the counter for a key, which is 0 until it is first advanced.
+    def get(self,key):
+        return int(self.client.get(self.prefix+str(key)) or 0)
+
+#   \brief - Advances the counter for a key.
+    def advance(self,key):
+        self.client.incr(self.prefix+str(key))
+
+#   \brief - Keeps counters in memory, for a single process.
+
+class MemoryCounters:
+
+#   \brief - Creates the counters.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+#   \brief - Returns the value of the counter for a key, which is 0 until it is first advanced.
+    def get(self,key):
+        with self.lock:
+            return self.counters.get(key,0)
+
+#   \brief - Advances the counter for a key.
+    def advance(self,key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key,0)+1
@@ -0,0 +1,344 @@
+import re
+import html
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+import urllib.request
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+import feedparser
+from .matching import normalise_entry, fields
+from .cache import LRUCache
+from .metrics import metrics
+
+html_tag_regex = re.compile('<.*?>', flags=re.DOTALL) #Matches HTML tags, including tags split over several lines.
+tracking_parameters = ("fbclid","gclid","cmpid","ocid","smid","smtyp") #Query string parameters, besides utm_*, which only track where a reader came from.
+user_agent = "SmartRSS/1.0 (+feedparser/"+feedparser.__version__+")" #Sent to upstream servers with every feed request.
+
+#   \brief - A process-wide cache of parsed feeds shared by every user, keyed by feed URL.
+
+#   Each record holds the feed's entries along with the ETag and Last-Modified values sent by the server, so that expired records can be revalidated with a conditional request, and a stamp which changes whenever the entries are replaced. Once the cache holds more than max_size feeds, the least recently used feed is evicted.
+
+#   The cache also has a generation, which the ingester advances after each round of polling which changed any feed, so that users' data can be rebuilt from the new feeds. This cache only works within a single process; RedisFeedCache shares the same records between processes.
+
+class FeedCache:
+
+#   \brief - Creates an empty cache.
+
+#   \param max_size - The maximum number of feeds held.
+
+    def __init__(self,max_size=1024):
+        self.lock = threading.Lock()
+        self.records = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.generation_count = 0
+
+#   \brief - Returns the cached record for a feed URL, or None if it has never been fetched.
+    def get(self,url):
+        with self.lock:
+            record = self.records.get(url)
+            if record is not None:
+                self.records.move_to_end(url)
+            return record
+
+#   \brief - Saves a freshly downloaded feed, along with the number of seconds the feed asks to be cached for (its <ttl>), if any.
+    def put(self,url,entries,etag,modified,poll_interval=None):
+        with self.lock:
+            self.records[url] = {"entries": entries, "etag": etag, "modified": modified, "fetched": time.time(), "poll_interval": poll_interval, "stamp": uuid.uuid4().hex}
+            self.records.move_to_end(url)
+            while len(self.records) > self.max_size:
+                self.records.popitem(last=False)
+
+#   \brief - Marks a cached record as fresh again after the server replied 304 Not Modified.
+    def touch(self,url):
+        with self.lock:
+            record = self.records.get(url)
+            if record is not None: #The record may have been evicted while the server was replying.
+                record["fetched"] = time.time()
+
+#   \brief - Removes every feed which is not in a set of URLs, eg. feeds no longer tracked by any user.
+    def retain(self,urls):
+        with self.lock:
+            for url in [url for url in self.records if url not in urls]:
+                del self.records[url]
+
+#   \brief - Increments one of the hit, miss or revalidation counters.
+    def count(self,counter):
+        with self.lock:
+            setattr(self,counter,getattr(self,counter)+1)
+
+#   \brief - Returns the hit, miss and revalidation counters and the number of cached feeds.
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "revalidations": self.revalidations, "feeds": len(self.records)}
+
+#   \brief - Returns the generation of the cache, which changes whenever the ingester has changed any feed.
+    def generation(self):
+        with self.lock:
+            return self.generation_count
+
+#   \brief - Advances the generation of the cache.
+    def advance(self):
+        with self.lock:
+            self.generation_count += 1
+
+#   \brief - A feed cache kept in Redis, shared by every worker process and by the ingester, so that every worker sees the same feeds and each feed is only polled once.
+
+#   Each feed is a Redis hash holding its entries as JSON alongside the same values as a FeedCache record. The parsed entries of recently read feeds are also kept in each process under their stamp, so a feed is only read and parsed again after it has changed. Stories are saved with their normalised title and summary, and their sets of words are split out again when they are read.
+
+class RedisFeedCache:
+
+#   \brief - Creates the cache.
+
+#   \param client - The Redis client.
+#   \param max_size - The number of feeds whose parsed entries are kept in this process.
+
+    def __init__(self,client,max_size):
+        self.client = client
+        self.parsed = LRUCache(max_size) #The stamp and parsed entries of recently read feeds, under their URL as the key.
+
+#   \brief - Returns the cached record for a feed URL, or None if it has never been fetched.
+    def get(self,url):
+        key = "feed:"+url
+        etag, modified, fetched, poll_interval, stamp = self.client.hmget(key,"etag","modified","fetched","poll_interval","stamp")
+        if stamp is None:
+            return None
+        stamp = stamp.decode()
+        parsed = self.parsed.get(url)
+        if parsed is None or parsed[0] != stamp:
+            content = self.client.hget(key,"entries")
+            if content is None: #The feed was removed since its stamp was read.
+                return None
+            parsed = (stamp, [load_entry(entry) for entry in json.loads(content)])
+            self.parsed.put(url,parsed)
+        return {"entries": parsed[1], "etag": etag.decode() or None, "modified": modified.decode() or None, "fetched": float(fetched), "poll_interval": float(poll_interval) if poll_interval else None, "stamp": stamp}
+
+#   \brief - Saves a freshly downloaded feed, along with the number of seconds the feed asks to be cached for (its <ttl>), if any.
+    def put(self,url,entries,etag,modified,poll_interval=None):
+        stamp = uuid.uuid4().hex
+        pipeline = self.client.pipeline()
+        pipeline.hset("feed:"+url, mapping={"entries": json.dumps([dump_entry(entry) for entry in entries]), "etag": etag or "", "modified": modified or "", "fetched": time.time(), "poll_interval": poll_interval or "", "stamp": stamp})
+        pipeline.sadd("feed:urls",url)
+        pipeline.execute()
+        self.parsed.put(url,(stamp,entries))
+
+#   \brief - Marks a cached record as fresh again after the server replied 304 Not Modified.
+    def touch(self,url):
+        if self.client.exists("feed:"+url): #The record may have been removed while the server was replying.
+            self.client.hset("feed:"+url,"fetched",time.time())
+
+#   \brief - Removes every feed which is not in a set of URLs, eg. feeds no longer tracked by any user.
+    def retain(self,urls):
+        old_urls = [url for url in (url.decode() for url in self.client.smembers("feed:urls")) if url not in urls]
+        if old_urls:
+            pipeline = self.client.pipeline()
+            pipeline.delete(*["feed:"+url for url in old_urls])
+            pipeline.srem("feed:urls",*old_urls)
+            pipeline.execute()
+
+#   \brief - Increments one of the hit, miss or revalidation counters.
+    def count(self,counter):
+        self.client.hincrby("feed:stats",counter,1)
+
+#   \brief - Returns the hit, miss and revalidation counters and the number of cached feeds.
+    def stats(self):
+        counters = self.client.hgetall("feed:stats")
+        stats = {counter: int(counters.get(counter.encode(),0)) for counter in ("hits","misses","revalidations")}
+        stats["feeds"] = self.client.scard("feed:urls")
+        return stats
+
+#   \brief - Returns the generation of the cache, which changes whenever the ingester has changed any feed.
+    def generation(self):
+        return int(self.client.get("feed:generation") or 0)
+
+#   \brief - Advances the generation of the cache.
+    def advance(self):
+        self.client.incr("feed:generation")
+
+#   \brief - Converts a normalised story into a form which can be saved as JSON.
+
+#   \param entry - The normalised story.
+
+#   \returns - The story without its sets of words.
+
+def dump_entry(entry):
+    return {key: entry[key] for key in entry if key != 'tokens'}
+
+#   \brief - Reads a story saved by dump_entry(), splitting out its sets of words again.
+
+#   \param entry - The saved story.
+
+#   \returns - The normalised story.
+
+def load_entry(entry):
+    if 'normalised' in entry:
+        entry['tokens'] = {field: frozenset(entry['normalised'][field].split()) for field in fields}
+    return normalise_entry(entry)
+
+#   \brief - Removes HTML code from string and decodes HTML entities such as &amp;.
+
+#   \param raw - String from which the HTML code is to be removed.
+
+def clean_html(raw):
+    clean = html_tag_regex.sub('', raw)
+    return html.unescape(clean)
+
+#   \brief - Returns the canonical form of a story's link, so that the same story linked from several feeds is only stored once.
+
+#   The canonical form is only used to identify the story. It may not lead to the same page, so the story's original link is kept to be shown to users.
+
+#   The scheme and host are made lower case, the fragment is removed, and tracking parameters such as utm_source are removed from the query string.
+
+#   \param link - The link to the story.
+
+#   \returns - The canonical link.
+
+def canonical_link(link):
+    parts = urllib.parse.urlsplit(link.strip())
+    query = [(key,value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if not key.lower().startswith("utm_") and key.lower() not in tracking_parameters]
+    return urllib.parse.urlunsplit((parts.scheme.lower(),parts.netloc.lower(),parts.path or "/",urllib.parse.urlencode(query),""))
+
+#   \brief - Takes only the necessary attributes from each story in a parsed feed.
+
+#   Each story's link is made canonical, with the link as published kept under 'url'. Stories without a link use their guid instead, and stories with neither are skipped. HTML is removed from summaries, entities are decoded, and each story is normalised for matching.
+
+#   \param feed_data - The parsed feed.
+
+#   \returns - The list of stories, each as a dictionary.
+
+def trunc_entries(feed_data):
+    trunc_feed_data = []
+    for entry in feed_data.entries:
+        link = entry.get('link') or entry.get('id')
+        if not link:
+            continue
+        entry_data = {}
+        entry_data['title'] = html.unescape(entry.get('title',""))
+        try:
+            entry_data['summary'] = clean_html(entry.summary)
+        except AttributeError:
+            entry_data['summary'] = ""
+        entry_data['link'] = canonical_link(link) #Identifies the story in snapshots, the archive and the index.
+        entry_data['url'] = link.strip() #The link shown to users, which is the one the publisher is known to serve.
+        try:
+            entry_data['published'] = entry.published
+        except AttributeError:
+            entry_data['published'] = "" #Takes only necessary attributes from stories.
+        trunc_feed_data.append(normalise_entry(entry_data)) #Normalise each story once, as it is ingested.
+    return trunc_feed_data
+
+#   \brief - Downloads a single RSS feed, reading through the feed cache.
+
+#   A record younger than ttl seconds is returned without contacting the server. Older records are revalidated with If-None-Match/If-Modified-Since, so an unchanged feed only costs a 304 response.
+
+#   \param url - The URL of the RSS feed.
+#   \param timeout - The number of seconds to wait for the server before giving up.
+#   \param cache - The feed cache to read through, or None to always download the feed.
+#   \param ttl - The number of seconds a cached feed is reused before being revalidated.
+
+#   \returns - The list of stories in the feed.
+
+def fetch_feed(url,timeout,cache=None,ttl=0):
+    headers = {"User-Agent": user_agent}
+    record = None
+    if cache is not None:
+        record = cache.get(url)
+    if record is not None:
+        if time.time()-record["fetched"] < ttl:
+            cache.count("hits")
+            return record["entries"]
+        if record["etag"]:
+            headers["If-None-Match"] = record["etag"]
+        if record["modified"]:
+            headers["If-Modified-Since"] = record["modified"]
+    request = urllib.request.Request(url, headers=headers)
+    host = urllib.parse.urlsplit(url).netloc #Feeds are labelled by host rather than URL, so the number of metrics stays small.
+    try:
+        with metrics.timer("feed_fetch_seconds",host=host):
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                content = response.read()
+                response_headers = {name.lower(): value for name, value in response.headers.items()} #feedparser looks headers up by their lower case names.
+                response_headers.setdefault("content-location",response.geturl()) #Resolve relative links against the URL the feed was served from.
+                etag = response.headers.get("ETag")
+                modified = response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and record is not None:
+            metrics.increment("feed_fetches_total",host=host,result="not_modified")
+            cache.touch(url)
+            cache.count("revalidations")
+            return record["entries"]
+        metrics.increment("feed_fetches_total",host=host,result="error")
+        raise
+    except Exception:
+        metrics.increment("feed_fetches_total",host=host,result="error")
+        raise
+    metrics.increment("feed_fetches_total",host=host,result="ok")
+    metrics.increment("feed_bytes_total",len(content),host=host)
+    with metrics.timer("stage_seconds",stage="parse"):
+        feed_data = feedparser.parse(content, response_headers=response_headers) #Passes the headers along with the content, so feeds which only declare their encoding in the Content-Type charset are decoded correctly.
+    feed_data.feed.link #Check that the feed has been parsed properly.
+    with metrics.timer("stage_seconds",stage="clean"):
+        entries = trunc_entries(feed_data) #Removes HTML and normalises each story.
+    if cache is not None:
+        try:
+            poll_interval = int(feed_data.feed.ttl)*60 #RSS gives the time to live in minutes.
+        except (AttributeError, ValueError):
+            poll_interval = None
+        cache.put(url,entries,etag,modified,poll_interval)
+        cache.count("misses")
+    return entries
+
+#   \brief - Downloads every feed of every outlet at the same time using a bounded pool of threads.
+
+#   Feeds which fail are reported in the failed list. Feeds which have not finished when the global deadline passes are reported in the slow list and their results are discarded.
+
+#   \param all_feeds - The dictionary of feed URL lists under the outlet names as keys.
+#   \param workers - The maximum number of feeds downloaded at once.
+#   \param timeout - The number of seconds to wait for a single server before giving up.
+#   \param deadline - The number of seconds after which the whole fetch gives up on any unfinished feeds.
+#   \param cache - The feed cache to read through, or None to always download every feed.
+#   \param ttl - The number of seconds a cached feed is reused before being revalidated.
+#   \param progress - A function called with the outlet and URL of each feed as it finishes, or None.
+
+#   \returns results - A dictionary with a list for each outlet, containing the stories of each working feed in the same order as the feed URLs.
+#   \returns failed - The list of feed URLs which could not be fetched or parsed.
+#   \returns slow - The list of feed URLs which did not finish before the deadline.
+
+def fetch_all(all_feeds,workers,timeout,deadline,cache=None,ttl=0,progress=None):
+    results = {}
+    failed = []
+    slow = []
+    jobs = {}
+    executor = ThreadPoolExecutor(max_workers=max(1,workers))
+    try:
+        for outlet in all_feeds:
+            for feed in all_feeds[outlet]:
+                jobs[executor.submit(fetch_feed,feed,timeout,cache,ttl)] = (outlet,feed)
+        done = set()
+        try:
+            for future in as_completed(jobs, timeout=deadline): #Stop waiting for the remaining feeds once the deadline has passed.
+                done.add(future)
+                if progress is not None:
+                    progress(*jobs[future])
+        except TimeoutError:
+            pass
+        not_done = set(jobs)-done
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    for outlet in all_feeds:
+        results[outlet] = []
+    for future in jobs: #Futures are kept in submission order so the feeds of each outlet stay in their original order.
+        outlet, feed = jobs[future]
+        if future in not_done:
+            slow.append(feed)
+        elif future.exception() is not None:
+            failed.append(feed)
+        else:
+            results[outlet].append(future.result())
+    return results, failed, slow
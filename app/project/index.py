@@ -0,0 +1,367 @@
+import json
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from .matching import normalise_entry, get_matcher, fields
+from .archive import connect
+
+#   \brief - An inverted index over every story a user has fetched, which answers searches from posting lists instead of scanning every story.
+
+#   Each story is given a document number the first time it is seen. For both the title and the summary, each word maps to the list of document numbers of stories containing it. The index also remembers which stories make up the current snapshot for each outlet, in their original order, so that search results come out in the same order as a scan of the snapshot would give, along with the version of that snapshot.
+
+#   Stories which are in neither the current snapshot nor a snapshot still kept in the archive are pruned, so the index only grows as far as the archive's retention allows. The index is saved in tables of the user's archive database. Only the stories and issues which have changed since the index was last saved are written, unless another process has saved the index in the meantime, in which case the whole index is written again.
+
+class InvertedIndex:
+
+#   \brief - Creates an empty index.
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None #The version of the current snapshot, as computed by pipeline.build_snapshot().
+        self.docs = {} #Every indexed story, under its document number as the key.
+        self.next_id = 0 #The document number given to the next new story. Document numbers are never reused.
+        self.doc_ids = {} #The document number of each story, under its link, title and summary as the key.
+        self.postings = {field: {} for field in fields} #The document numbers containing each word, for each field.
+        self.outlets = {} #The document numbers in the current snapshot for each outlet, mapped to their position within the outlet.
+        self.current = {} #The outlets containing each document in the current snapshot.
+        self.issues = {} #The tags of each tracked issue, the rankings of the documents matching them and how many documents have been matched, under the issue name as the key.
+        self.dirty = False #True if the index has changed since it was last saved.
+        self.revision = None #The number of times the index had been saved when this copy was last read or saved, or None if it never has been.
+        self.added = set() #The document numbers added since the index was last saved.
+        self.removed = set() #The document numbers pruned since the index was last saved.
+        self.changed_issues = set() #The issues whose tags or rankings have changed since the index was last saved.
+        self.forgotten = set() #The issues forgotten since the index was last saved.
+        self.current_changed = False #True if the current snapshot has changed since the index was last saved.
+
+#   \brief - Indexes a story, doing nothing if it has already been indexed.
+
+#   A story whose title or summary has changed since it was indexed is indexed again as a separate document.
+
+#   \param entry - The story to be indexed.
+
+#   \returns - The document number of the story, and True if the story was not already indexed.
+
+    def add(self,entry):
+        doc = {'title': entry.get('title',""), 'summary': entry.get('summary',""), 'link': entry['link'], 'published': entry.get('published',""), 'url': entry.get('url') or entry['link']}
+        if 'tokens' in entry: #Reuse the normalised forms stored at ingestion.
+            doc['normalised'] = entry['normalised']
+            doc['tokens'] = entry['tokens']
+        entry = normalise_entry(doc)
+        key = (entry['link'],entry['title'],entry['summary'])
+        doc_id = self.doc_ids.get(key)
+        if doc_id is not None:
+            return doc_id, False
+        doc_id = self.next_id
+        self.next_id += 1
+        self.insert(doc_id,entry)
+        self.added.add(doc_id)
+        return doc_id, True
+
+#   \brief - Adds a normalised story to the index under a given document number.
+
+#   \param doc_id - The document number.
+#   \param entry - The story, normalised by matching.normalise_entry().
+
+    def insert(self,doc_id,entry):
+        self.docs[doc_id] = entry
+        self.doc_ids[(entry['link'],entry['title'],entry['summary'])] = doc_id
+        for field in fields:
+            postings = self.postings[field]
+            for word in entry['tokens'][field]:
+                doc_ids = postings.get(word)
+                if doc_ids is None:
+                    postings[word] = {doc_id}
+                else:
+                    doc_ids.add(doc_id)
+
+#   \brief - Removes every story which is not in the current snapshot and whose link is not in a set of links, along with its postings and rankings.
+
+#   \param links - The set of links to keep, eg. every link in a snapshot kept in the archive.
+
+#   \returns - The number of stories removed.
+
+    def prune(self,links):
+        with self.lock:
+            old_docs = [doc_id for doc_id, entry in self.docs.items() if doc_id not in self.current and entry['link'] not in links]
+            for doc_id in old_docs:
+                entry = self.docs.pop(doc_id)
+                del self.doc_ids[(entry['link'],entry['title'],entry['summary'])]
+                for field in fields:
+                    for word in entry['tokens'][field]:
+                        postings = self.postings[field][word]
+                        postings.discard(doc_id)
+                        if not postings:
+                            del self.postings[field][word]
+                for issue, record in self.issues.items():
+                    if record['ranks'].pop(doc_id,None) is not None:
+                        self.changed_issues.add(issue)
+                self.added.discard(doc_id)
+                self.removed.add(doc_id)
+            if old_docs:
+                self.dirty = True
+            return len(old_docs)
+
+#   \brief - Adds any new stories in a freshly fetched data dictionary to the index and makes it the current snapshot.
+
+#   Stories which were already indexed are not tokenised again.
+
+#   \param data - The data dictionary containing all the RSS data, as built by pipeline.build_snapshot().
+
+#   \returns - The set of document numbers which were added to the index.
+
+    def update(self,data):
+        with self.lock:
+            self.dirty = True
+            self.current_changed = True
+            self.version = data['version']
+            new_docs = set()
+            self.outlets = {}
+            self.current = {}
+            doc_ids = {}
+            for link in data['entries']:
+                doc_id, is_new = self.add(data['entries'][link])
+                if is_new:
+                    new_docs.add(doc_id)
+                doc_ids[link] = doc_id
+            for outlet in data['outlets']:
+                positions = {}
+                for feed in data['outlets'][outlet]:
+                    for link in feed:
+                        doc_id = doc_ids[link]
+                        if doc_id not in positions:
+                            positions[doc_id] = len(positions)
+                            self.current.setdefault(doc_id,[]).append(outlet)
+                self.outlets[outlet] = positions
+            return new_docs
+
+#   \brief - Makes a snapshot the current one for the duration of a with statement, so that results refer only to stories in that snapshot.
+
+#   The index is shared by every request of a user and a background refresh may move it on to a newer snapshot at any time. The index is locked for the duration of the with statement, and is updated to the snapshot first if it does not hold that version.
+
+#   \param data - The data dictionary of the snapshot, as built by pipeline.build_snapshot().
+
+#   \returns - The index, as the target of the with statement.
+
+    @contextmanager
+    def pinned(self,data):
+        with self.lock:
+            if self.version != data['version']:
+                self.update(data)
+            yield self
+
+#   \brief - Returns the ranking of every story in scope matching at least one of the terms.
+
+#   Single word terms are answered straight from the posting lists. Terms of several words are checked against only the stories containing every one of their words.
+
+#   \param terms - The list of terms to be matched.
+#   \param scope - The document numbers which may be matched, or None for the current snapshot.
+
+#   \returns - A dictionary of rankings, under the document number as the key.
+
+    def rank(self,terms,scope=None):
+        if scope is None:
+            scope = self.current
+        matcher = get_matcher(terms)
+        ranks = Counter()
+        for word in matcher.words:
+            for doc_id in self.postings['title'].get(word,()):
+                if doc_id in scope:
+                    ranks[doc_id] += 2*matcher.words[word]
+            for doc_id in self.postings['summary'].get(word,()):
+                if doc_id in scope:
+                    ranks[doc_id] += matcher.words[word]
+        for phrase_words, test_whole_word in matcher.phrases:
+            candidates = None
+            for word in phrase_words:
+                containing = self.postings['title'].get(word,set()) | self.postings['summary'].get(word,set())
+                if candidates is None:
+                    candidates = containing
+                else:
+                    candidates = candidates & containing #Only stories containing every word of the term can match it.
+            if candidates is None:
+                candidates = scope
+            for doc_id in candidates:
+                if doc_id in scope:
+                    entry = self.docs[doc_id]
+                    if test_whole_word(entry['normalised']['title']):
+                        ranks[doc_id] += 2
+                    if test_whole_word(entry['normalised']['summary']):
+                        ranks[doc_id] += 1
+        return ranks
+
+#   \brief - Groups the ranked stories in the current snapshot by outlet.
+
+#   \param ranks - A dictionary of rankings, under the document number as the key. Documents outside the current snapshot are ignored.
+
+#   \returns matched_data - The dictionary containing a list for each outlet of the stories which matched at least one of the terms, in descending order of ranking.
+#   \returns count - The number of entries matched.
+
+    def group(self,ranks):
+        matched = {}
+        for doc_id in ranks:
+            if ranks[doc_id] != 0 and doc_id in self.current:
+                for outlet in self.current[doc_id]:
+                    matched.setdefault(outlet,[]).append(doc_id)
+        matched_data = {}
+        count = 0
+        for outlet in self.outlets:
+            if outlet in matched:
+                positions = self.outlets[outlet]
+                doc_ids = sorted(matched[outlet], key=positions.get) #Each link is only stored once in a snapshot, so no two matches in an outlet share a link.
+                doc_ids.sort(key=ranks.get, reverse=True) #Sort by descending ranking, keeping stories with the same ranking in their original order.
+                matched_data[outlet] = [dict(self.docs[doc_id]) for doc_id in doc_ids]
+                count += len(doc_ids)
+        return matched_data, count
+
+#   \brief - Finds the stories in the current snapshot which match at least one of the terms.
+
+#   The results are left unsorted, as a page of the best results can be picked from them without sorting every match. Each result is a tuple which sorts in the order results are shown: by descending ranking, then by outlet, then by position within the outlet. A story in several outlets gives a result for each.
+
+#   \param terms - The list of terms to be matched.
+
+#   \returns - The list of results, each as a tuple of the negated ranking, the outlet's position, the story's position within the outlet, the outlet and the story's link.
+
+    def search(self,terms):
+        with self.lock:
+            ranks = self.rank(terms)
+            outlet_positions = {outlet: position for position, outlet in enumerate(self.outlets)}
+            results = []
+            for doc_id in ranks:
+                if ranks[doc_id] != 0 and doc_id in self.current:
+                    for outlet in self.current[doc_id]:
+                        results.append((-ranks[doc_id],outlet_positions[outlet],self.outlets[outlet][doc_id],outlet,self.docs[doc_id]['link']))
+            return results
+
+#   \brief - Finds the stories in the current snapshot which match a tracked issue, matching as few stories as possible.
+
+#   The rankings of every indexed story against each issue are kept. When the index has grown since the issue was last matched, only the new stories are matched. Every story is matched again only if the issue's tags have changed.
+
+#   \param issue - The name of the issue.
+#   \param terms - The list of the issue's tags.
+
+#   \returns - The matched stories and their count, as returned by group().
+
+    def match_issue(self,issue,terms):
+        with self.lock:
+            record = self.issues.get(issue)
+            if record is None or record['tags'] != list(terms):
+                record = {'tags': list(terms), 'ranks': dict(self.rank(terms,self.docs)), 'matched': self.next_id}
+                self.issues[issue] = record
+                self.changed_issues.add(issue)
+                self.dirty = True
+            elif record['matched'] < self.next_id:
+                new_docs = {doc_id for doc_id in range(record['matched'],self.next_id) if doc_id in self.docs} #Document numbers are given in order, so only the newest stories need matching.
+                if len(new_docs)*4 < len(self.docs):
+                    matcher = get_matcher(terms)
+                    ranks = {}
+                    for doc_id in new_docs: #Match a handful of new stories directly.
+                        ranking = matcher.rank(self.docs[doc_id])
+                        if ranking != 0:
+                            ranks[doc_id] = ranking
+                else:
+                    ranks = self.rank(terms,new_docs) #Match many new stories through the posting lists.
+                record['ranks'].update(ranks)
+                record['matched'] = self.next_id
+                self.changed_issues.add(issue)
+                self.dirty = True
+            return self.group(record['ranks'])
+
+#   \brief - Forgets the rankings kept for issues which are no longer tracked.
+
+#   \param issues - The names of the issues which are still tracked.
+
+    def forget_issues(self,issues):
+        with self.lock:
+            for issue in list(self.issues):
+                if issue not in issues:
+                    del self.issues[issue]
+                    self.changed_issues.discard(issue)
+                    self.forgotten.add(issue)
+                    self.dirty = True
+
+#   \brief - Saves the index to the archive database, writing only what has changed since it was last saved if no other process has saved it since.
+
+#   \param db_path - The path to the archive database.
+
+#   \returns - The new revision of the saved index.
+
+    def save(self,db_path):
+        with self.lock:
+            connection = connect(db_path)
+            try:
+                with connection:
+                    connection.execute("BEGIN IMMEDIATE") #Stops another process saving the index between reading its revision and writing it.
+                    row = connection.execute("SELECT value FROM index_state WHERE key = 'revision'").fetchone()
+                    revision = 0 if row is None else int(row[0])
+                    if revision != self.revision: #The saved index is not the one this copy was read from, so it is replaced whole.
+                        for table in ("index_docs","index_current","index_issues"):
+                            connection.execute("DELETE FROM "+table)
+                        added, removed, forgotten, changed_issues, current_changed = self.docs, (), (), self.issues, True
+                    else:
+                        added, removed, forgotten, changed_issues, current_changed = [doc_id for doc_id in self.added if doc_id in self.docs], self.removed, self.forgotten, self.changed_issues, self.current_changed
+                    connection.executemany("DELETE FROM index_docs WHERE id = ?", [(doc_id,) for doc_id in removed])
+                    connection.executemany("INSERT OR REPLACE INTO index_docs (id, link, title, summary, published, normalised_title, normalised_summary, url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                           [(doc_id, entry['link'], entry['title'], entry['summary'], entry['published'], entry['normalised']['title'], entry['normalised']['summary'], entry['url'])
+                                            for doc_id, entry in ((doc_id, self.docs[doc_id]) for doc_id in added)])
+                    connection.executemany("DELETE FROM index_issues WHERE name = ?", [(issue,) for issue in forgotten])
+                    connection.executemany("INSERT OR REPLACE INTO index_issues (name, tags, matched, ranks) VALUES (?, ?, ?, ?)", #Each issue's rankings are saved as one value, as a common tag can match thousands of stories.
+                                           [(issue, json.dumps(self.issues[issue]['tags']), self.issues[issue]['matched'], json.dumps(list(self.issues[issue]['ranks'].items()))) for issue in changed_issues])
+                    if current_changed:
+                        connection.execute("DELETE FROM index_current")
+                        connection.executemany("INSERT INTO index_current (outlet_position, outlet, position, doc_id) VALUES (?, ?, ?, ?)",
+                                               [(outlet_position, outlet, position, doc_id) for outlet_position, outlet in enumerate(self.outlets) for doc_id, position in self.outlets[outlet].items()])
+                    connection.executemany("INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)", [("version", self.version), ("next_id", self.next_id), ("revision", revision+1)])
+            finally:
+                connection.close()
+            self.revision = revision+1
+            self.added = set()
+            self.removed = set()
+            self.changed_issues = set()
+            self.forgotten = set()
+            self.current_changed = False
+            self.dirty = False
+            return self.revision
+
+#   \brief - Reads an index saved by save().
+
+#   \param db_path - The path to the archive database.
+
+#   \returns - The index.
+
+    @classmethod
+    def load(cls,db_path):
+        index = cls()
+        connection = connect(db_path)
+        try:
+            state = dict(connection.execute("SELECT key, value FROM index_state"))
+            index.version = state.get('version')
+            index.next_id = int(state.get('next_id',0))
+            index.revision = int(state.get('revision',0))
+            for doc_id, link, title, summary, published, normalised_title, normalised_summary, url in connection.execute("SELECT id, link, title, summary, published, normalised_title, normalised_summary, url FROM index_docs"):
+                entry = {'title': title, 'summary': summary, 'link': link, 'published': published, 'url': url or link, 'normalised': {'title': normalised_title, 'summary': normalised_summary}}
+                entry['tokens'] = {field: frozenset(entry['normalised'][field].split()) for field in fields} #The words of each story are not saved, as they are quicker to split out again than to read.
+                index.insert(doc_id,entry)
+            for issue, tags, matched, ranks in connection.execute("SELECT name, tags, matched, ranks FROM index_issues"):
+                index.issues[issue] = {'tags': json.loads(tags), 'ranks': dict(json.loads(ranks)), 'matched': matched}
+            for outlet, doc_id in connection.execute("SELECT outlet, doc_id FROM index_current ORDER BY outlet_position, position"):
+                positions = index.outlets.setdefault(outlet,{})
+                positions[doc_id] = len(positions)
+                index.current.setdefault(doc_id,[]).append(outlet)
+        finally:
+            connection.close()
+        return index
+
+#   \brief - Returns how many times the index in an archive database has been saved, without reading it.
+
+#   \param db_path - The path to the archive database.
+
+#   \returns - The revision of the saved index, or None if no index has been saved.
+
+def saved_revision(db_path):
+    connection = connect(db_path)
+    try:
+        row = connection.execute("SELECT value FROM index_state WHERE key = 'revision'").fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    return int(row[0])
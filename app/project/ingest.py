@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+from .fetch import fetch_all
+
+#   \brief - A background thread which keeps the shared feed cache up to date, so that users never have to wait on upstream RSS servers.
+
+#   Every feed tracked by any user is polled on its own schedule. A feed is polled every poll_interval seconds, or less often if the feed's own <ttl> asks for it. Feeds which fail are backed off exponentially, up to max_backoff seconds between attempts.
+
+class Ingester(threading.Thread):
+
+#   \brief - Creates the ingestion thread.
+
+#   \param cache - The feed cache which ingested feeds are saved to.
+#   \param list_feeds - A function which returns the set of all feed URLs currently tracked by any user.
+#   \param poll_interval - The default number of seconds between polls of a feed.
+#   \param max_backoff - The maximum number of seconds between polls of a failing feed.
+#   \param workers - The maximum number of feeds downloaded at once.
+#   \param timeout - The number of seconds to wait for a single server before giving up.
+#   \param deadline - The number of seconds after which a round of polling gives up on any unfinished feeds.
+
+    def __init__(self,cache,list_feeds,poll_interval,max_backoff,workers,timeout,deadline):
+        super().__init__(name="feed-ingester", daemon=True)
+        self.cache = cache
+        self.list_feeds = list_feeds
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.workers = workers
+        self.timeout = timeout
+        self.deadline = deadline
+        self.next_poll = {} #The time at which each feed is next due, under its URL as the key.
+        self.failures = {} #The number of consecutive failed polls of each feed, under its URL as the key.
+        self.stopped = threading.Event()
+        self.pid = os.getpid() #The process the thread was started in.
+
+#   \brief - Returns the number of seconds to wait before polling a feed again.
+
+#   \param url - The URL of the feed.
+
+    def interval(self,url):
+        failures = self.failures.get(url,0)
+        if failures:
+            return min(self.poll_interval*2**failures,self.max_backoff) #Back off exponentially from failing feeds.
+        record = self.cache.get(url)
+        if record is not None and record["poll_interval"]:
+            return max(self.poll_interval,record["poll_interval"]) #Never poll a feed more often than it asks to be polled.
+        return self.poll_interval
+
+#   \brief - Returns the stamp of a feed's cached record, which changes whenever its entries do.
+
+#   \param url - The URL of the feed.
+
+#   \returns - The stamp, or None if the feed is not cached.
+
+    def stamp(self,url):
+        record = self.cache.get(url)
+        if record is None:
+            return None
+        return record["stamp"]
+
+#   \brief - Polls every tracked feed which is due, then schedules its next poll.
+
+#   If any feed changed, the cache's generation is advanced once for the whole round, so that users' data is rebuilt at most once per round.
+
+#   \returns - The number of seconds until the next feed is due.
+
+    def poll(self):
+        now = time.time()
+        feeds = self.list_feeds()
+        if not feeds:
+            return self.poll_interval #Nothing is tracked, or the users' files could not be listed, so leave the cache as it is rather than emptying it.
+        for url in list(self.next_poll):
+            if url not in feeds: #Forget feeds which are no longer tracked by anyone.
+                del self.next_poll[url]
+                self.failures.pop(url,None)
+        self.cache.retain(feeds)
+        due = [url for url in feeds if self.next_poll.get(url,0) <= now]
+        if due:
+            stamps = {url: self.stamp(url) for url in due}
+            results, failed, slow = fetch_all({"due": due},self.workers,self.timeout,self.deadline,self.cache,0) #A ttl of 0 always revalidates with the server.
+            unsuccessful = set(failed+slow)
+            now = time.time()
+            for url in due:
+                if url in unsuccessful:
+                    self.failures[url] = self.failures.get(url,0)+1
+                else:
+                    self.failures.pop(url,None)
+                self.next_poll[url] = now+self.interval(url)
+            if any(self.stamp(url) != stamps[url] for url in due):
+                self.cache.advance()
+        if not self.next_poll:
+            return self.poll_interval
+        return max(1,min(self.next_poll.values())-time.time())
+
+#   \brief - Polls feeds until the thread is stopped.
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                wait = self.poll()
+            except Exception:
+                wait = self.poll_interval #Keep the thread alive if a round of polling fails unexpectedly.
+            self.stopped.wait(min(wait,self.poll_interval))
+
+#   \brief - Stops the thread after the current round of polling.
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import redis
+from concurrent.futures import ThreadPoolExecutor
+
+#   Refreshes run as background jobs, so the dashboard can be shown straight away while feeds are fetched, archived and analysed.
+
+#   Each user has at most one refresh in flight. A job store keeps the in-flight claim and the progress of each user's latest job, so that whichever worker process a status request reaches can answer it. The Redis store is used in production; the memory store only works within a single process and is meant for development and tests.
+
+#   Claims are leases: they expire after a few seconds unless the process running the job keeps renewing them, and the job's status records when it was last renewed. If a worker is killed mid-job, eg. by a timeout or when it is recycled, its user can refresh again once the lease runs out, and the job is reported as interrupted rather than running forever.
+
+logger = logging.getLogger(__name__)
+
+#   \brief - Keeps refresh job claims and progress in Redis, shared by every worker process.
+
+class RedisJobStore:
+
+#   \brief - Creates the store.
+
+#   \param client - The Redis client.
+#   \param timeout - The number of seconds the status of a user's latest refresh is kept.
+#   \param lease - The number of seconds after which a claim is released unless it is renewed.
+
+    def __init__(self,client,timeout,lease):
+        self.client = client
+        self.timeout = timeout
+        self.lease = lease
+
+#   \brief - Claims the right to run a refresh for a user, returning False if a refresh is already in flight.
+    def claim(self,user_id,job_id):
+        return bool(self.client.set("refresh:claim:"+str(user_id), job_id, nx=True, px=int(self.lease*1000)))
+
+#   \brief - Runs a change to a user's claim, but only if it is still held by the given job.
+
+#   \param user_id - The id of the user.
+#   \param job_id - The id of the job which should hold the claim.
+#   \param change - A function taking a pipeline in transaction mode, to which it adds the change.
+
+#   \returns - True if the job held the claim and the change was made.
+
+    def change_claim(self,user_id,job_id,change):
+        key = "refresh:claim:"+str(user_id)
+        with self.client.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                if pipeline.get(key) != job_id.encode():
+                    return False
+                pipeline.multi()
+                change(pipeline)
+                pipeline.execute()
+                return True
+            except redis.WatchError:
+                return False #The claim changed while it was being checked, so it is no longer this job's.
+
+#   \brief - Renews a job's claim for another lease, returning False if the job no longer holds it.
+    def renew(self,user_id,job_id):
+        return self.change_claim(user_id,job_id,lambda pipeline: pipeline.pexpire("refresh:claim:"+str(user_id),int(self.lease*1000)))
+
+#   \brief - Releases a job's claim once it has finished, unless the claim has since passed to another job.
+    def release(self,user_id,job_id):
+        self.change_claim(user_id,job_id,lambda pipeline: pipeline.delete("refresh:claim:"+str(user_id)))
+
+#   \brief - Saves the status of a user's latest refresh.
+    def put(self,user_id,status):
+        self.client.set("refresh:status:"+str(user_id), json.dumps(status), ex=int(self.timeout))
+
+#   \brief - Returns the status of a user's latest refresh, or None if there is none.
+    def get(self,user_id):
+        status = self.client.get("refresh:status:"+str(user_id))
+        if status is None:
+            return None
+        return json.loads(status)
+
+#   \brief - Removes the status of a user's latest refresh.
+    def pop(self,user_id):
+        self.client.delete("refresh:status:"+str(user_id))
+
+#   \brief - Keeps refresh job claims and progress in memory, for a single process.
+
+class MemoryJobStore:
+
+#   \brief - Creates the store.
+
+#   \param lease - The number of seconds after which a claim is released unless it is renewed.
+
+    def __init__(self,lease):
+        self.lock = threading.Lock()
+        self.lease = lease
+        self.claims = {} #The id of the job in flight and the time its claim was last renewed, under the user id as the key.
+        self.statuses = {}
+
+#   \brief - Returns whether a claim is held by any job, or by the given job. Must be called with the lock held.
+    def held(self,user_id,job_id=None):
+        claim = self.claims.get(user_id)
+        return claim is not None and time.time()-claim[1] < self.lease and job_id in (None,claim[0])
+
+#   \brief - Claims the right to run a refresh for a user, returning False if a refresh is already in flight.
+    def claim(self,user_id,job_id):
+        with self.lock:
+            if self.held(user_id):
+                return False
+            self.claims[user_id] = (job_id, time.time())
+            return True
+
+#   \brief - Renews a job's claim for another lease, returning False if the job no longer holds it.
+    def renew(self,user_id,job_id):
+        with self.lock:
+            if not self.held(user_id,job_id):
+                return False
+            self.claims[user_id] = (job_id, time.time())
+            return True
+
+#   \brief - Releases a job's claim once it has finished, unless the claim has since passed to another job.
+    def release(self,user_id,job_id):
+        with self.lock:
+            if self.held(user_id,job_id):
+                del self.claims[user_id]
+
+#   \brief - Saves the status of a user's latest refresh.
+    def put(self,user_id,status):
+        with self.lock:
+            self.statuses[user_id] = json.loads(json.dumps(status)) #Copy the status, as the Redis store would.
+
+#   \brief - Returns the status of a user's latest refresh, or None if there is none.
+    def get(self,user_id):
+        with self.lock:
+            return self.statuses.get(user_id)
+
+#   \brief - Removes the status of a user's latest refresh.
+    def pop(self,user_id):
+        with self.lock:
+            self.statuses.pop(user_id,None)
+
+#   \brief - Runs refresh jobs on a pool of threads, at most one at a time for each user.
+
+class RefreshQueue:
+
+#   \brief - Creates the queue.
+
+#   \param store - The job store holding claims and progress.
+#   \param workers - The number of refreshes which can run at once in each process.
+
+    def __init__(self,store,workers):
+        self.store = store
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+#   \brief - Returns the thread pool for this process, creating it if this is the first job since the process was forked.
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(max_workers=max(1,self.workers), thread_name_prefix="refresh")
+                self.pid = os.getpid()
+            return self.executor
+
+#   \brief - Returns the status of a user's latest refresh, or None if there is none.
+
+#   A job whose claim has not been renewed for a whole lease is reported as failed, as the worker running it must have died.
+
+#   \param user_id - The id of the user.
+
+#   \returns - The status of the refresh.
+
+    def status(self,user_id):
+        status = self.store.get(user_id)
+        if status is not None and status['state'] in ("queued","running") and time.time()-status.get('renewed',0) > self.store.lease:
+            return dict(status, state="failed", messages=status['messages']+["Refreshing feeds was interrupted, please try again."])
+        return status
+
+#   \brief - Queues a refresh for a user, unless one is already in flight.
+
+#   The job is called with a progress function, which takes keyword arguments to be saved in the job's status. The job returns a dictionary which is saved in the status once it has finished. Until then, a thread renews the job's claim and records the renewal in its status every third of a lease.
+
+#   \param user_id - The id of the user.
+#   \param job - The function which runs the refresh.
+
+#   \returns - The status of the user's refresh, and True if a new refresh was queued.
+
+    def enqueue(self,user_id,job):
+        job_id = uuid.uuid4().hex
+        if not self.store.claim(user_id,job_id):
+            return self.store.get(user_id), False #Coalesce with the refresh already in flight.
+        status = {'id': job_id, 'state': "queued", 'stage': "", 'outlets': {}, 'messages': [], 'queued': time.time(), 'renewed': time.time()}
+        self.store.put(user_id,status)
+        status_lock = threading.Lock() #Stops a renewal saving the status over a later change.
+        finished = threading.Event()
+        def progress(**changes):
+            with status_lock:
+                status.update(changes)
+                self.store.put(user_id,status)
+        def renew():
+            while not finished.wait(self.store.lease/3):
+                try:
+                    with status_lock:
+                        if status['state'] not in ("queued","running"):
+                            return
+                        if not self.store.renew(user_id,job_id):
+                            return #The lease ran out and the claim passed to another job, whose status replaces this one.
+                        status['renewed'] = time.time()
+                        self.store.put(user_id,status)
+                except Exception:
+                    logger.warning("Could not renew the refresh claim of user %s", user_id, exc_info=True) #Tried again on the next renewal.
+        def run():
+            progress(state="running")
+            try:
+                result = job(progress)
+            except Exception as error:
+                logger.exception("Refresh of user %s failed", user_id)
+                progress(state="failed", messages=status['messages']+["Refreshing feeds failed: "+str(error)])
+            else:
+                progress(state="done", **result)
+            finally:
+                finished.set()
+                self.store.release(user_id,job_id)
+        try:
+            self.get_executor().submit(run)
+        except Exception:
+            finished.set()
+            self.store.release(user_id,job_id)
+            raise
+        threading.Thread(target=renew, name="refresh-renew", daemon=True).start()
+        return status, True
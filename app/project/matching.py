@@ -0,0 +1,144 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+punctuation_regex = re.compile(r'[^\w\s]')
+topic_punctuation_regex = re.compile(r'[^\w\s-]') #Matches the punctuation removed from words counted as popular topics, which keeps hyphens, eg. in "Covid-19".
+
+fields = ("title","summary") #The fields of a story which are normalised and matched.
+
+#   \brief - Strips punctuation from a string and case-folds it.
+
+#   \param text - The string to be normalised.
+
+#   \returns nopunc - The string without punctuation, case-folded.
+#   \returns words - The set of whole words in the normalised string.
+
+def normalise_text(text):
+    nopunc = punctuation_regex.sub('',text.casefold())
+    return nopunc, frozenset(nopunc.split())
+
+#   \brief - Normalises a string, caching the result.
+
+#   Used for search terms and issue tags, which are normalised once for every search, and for stories which were stored before they were normalised at ingestion.
+
+#   \param text - The string to be normalised.
+
+#   \returns - The same as normalise_text().
+
+@lru_cache(maxsize=65536)
+def normalise(text):
+    return normalise_text(text)
+
+#   \brief - Normalises the title and summary of a story once, storing the results on the story for every later search, match and word count to reuse.
+
+#   Stories which have already been normalised are left as they are.
+
+#   \param entry - The story, whose title and summary must already have had HTML removed.
+
+#   \returns - The story, with its normalised title and summary under 'normalised' and their sets of words under 'tokens'.
+
+def normalise_entry(entry):
+    if 'tokens' not in entry:
+        entry['normalised'] = {}
+        entry['tokens'] = {}
+        for field in fields:
+            entry['normalised'][field], entry['tokens'][field] = normalise_text(entry.get(field,""))
+    return entry
+
+#   \brief - Returns the words of a story's title and summary as they are shown as popular topics, with their case and hyphens kept.
+
+#   Each word is only included once, however many times and however it is cased in the story. The words are not kept on the story, as they are only needed once per snapshot and would double the memory used by cached feeds.
+
+#   \param entry - The story.
+
+#   \returns - A dictionary of the first form of each word in the story, under its case-folded form as the key.
+
+def topic_words(entry):
+    topics = {}
+    for field in fields:
+        for word in topic_punctuation_regex.sub('',entry.get(field,"")).split():
+            if word.strip("-"): #Dashes used as punctuation are not words.
+                topics.setdefault(word.casefold(),word)
+    return topics
+
+#   \brief - Returns the normalised form and set of words of a field of a story, reusing those stored at ingestion if there are any.
+
+#   \param entry - The story.
+#   \param field - "title" or "summary".
+
+#   \returns - The same as normalise_text().
+
+def entry_field(entry,field):
+    try:
+        return entry['normalised'][field], entry['tokens'][field]
+    except KeyError:
+        return normalise(entry.get(field,""))
+
+#   \brief - Returns a regular expression object to test if the given word is present as a whole word in the tested string.
+
+#   \param word - The word to be searched for.
+
+#   \returns - A regular expression object to test if the given word is present as a whole word in the tested string.
+
+def whole_word(word):
+    return re.compile(r'\b({0})\b'.format(re.escape(word)), flags=re.IGNORECASE).search
+
+#   \brief - Ranks entries against a fixed list of terms.
+
+#   Built once per list of terms. Terms which are a single word are matched by looking them up in the set of words in the entry's title and summary. Terms made of several words keep a whole word regular expression, compiled once, alongside the list of their words.
+
+class Matcher:
+
+#   \brief - Normalises the terms and compiles the regular expressions for terms of several words.
+
+#   \param terms - The list of terms to be matched within entries.
+
+    def __init__(self,terms):
+        self.words = Counter() #The number of times each single word term appears in the list of terms.
+        self.phrases = []
+        for term in terms:
+            nopunc_term = normalise(term)[0] #Strips punctuation from the search term and case-folds it, in the same way as stories.
+            if nopunc_term != "" and nopunc_term.split() == [nopunc_term]:
+                self.words[nopunc_term] += 1
+            else:
+                self.phrases.append((nopunc_term.split(),whole_word(nopunc_term)))
+
+#   \brief - Returns the search ranking of an entry with respect to the terms.
+
+#   Ranking criteria:
+#   Base of 0 (no matches in title or summary).
+#   +2 For every term matched in the title.
+#   +1 For every term matched in the summary.
+
+#   \param entry - The entry for the terms to be matched with.
+
+#   \returns - The ranking of the entry.
+
+    def rank(self,entry):
+        nopunc_title, title_words = entry_field(entry,"title")
+        nopunc_summary, summary_words = entry_field(entry,"summary")
+        rank = 0
+        for word in self.words.keys() & title_words: #Checks which words are present as a whole word in the title.
+            rank += 2*self.words[word]
+        for word in self.words.keys() & summary_words: #Checks which words are present as a whole word in the summary.
+            rank += self.words[word]
+        for phrase_words, test_whole_word in self.phrases:
+            if test_whole_word(nopunc_title):
+                rank += 2
+            if test_whole_word(nopunc_summary):
+                rank += 1
+        return rank
+
+#   \brief - Returns the matcher for a list of terms, building it only if it has not been used recently.
+
+#   \param terms - The list of terms to be matched within entries.
+
+#   \returns - The matcher for the terms.
+
+def get_matcher(terms):
+    return cached_matcher(tuple(terms))
+
+@lru_cache(maxsize=256)
+def cached_matcher(terms):
+    return Matcher(terms)
@@ -0,0 +1,255 @@
+import time
+import json
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import render_template as flask_render_template
+
+#   Timings and counters for the slow parts of a refresh, exposed in the Prometheus text format on the admin metrics page.
+
+#   Metrics are kept in memory by each process. With the Redis shared store, each process also adds what it has recorded to totals in Redis at most every METRICS_FLUSH_INTERVAL seconds, and the metrics page reports the totals of every worker process and the ingester. Otherwise each scrape of the metrics page only reports the process which served it. Recording a metric only takes a lock and a few additions, so it is cheap enough to leave on in production.
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) #Upper bounds of the histogram buckets, in seconds.
+
+#   \brief - A thread-safe registry of counters and histograms, each of which can have labels.
+
+class Metrics:
+
+#   \brief - Creates an empty registry.
+
+#   \param prefix - The prefix added to the name of every metric.
+
+    def __init__(self,prefix):
+        self.lock = threading.Lock()
+        self.prefix = prefix
+        self.help = {} #The description and type of each metric, under its name as the key.
+        self.counters = {} #The value of each counter, under its name and labels as the key.
+        self.histograms = {} #The bucket counts, sum and count of each histogram, under its name and labels as the key.
+        self.client = None #The Redis client the metrics are shared through, or None if they are only kept in this process.
+        self.pending = {} #The amounts recorded since the last flush to Redis, under the name, labels and part of each series as the key.
+        self.flush_lock = threading.Lock()
+        self.flush_interval = 0
+        self.flushed = time.monotonic()
+
+#   \brief - Shares the metrics of this process with every other process through Redis, so that the metrics page reports their totals.
+
+#   \param client - The Redis client.
+#   \param flush_interval - The most seconds recorded metrics are held in this process before being added to the totals in Redis.
+
+    def share(self,client,flush_interval):
+        with self.lock:
+            self.client = client
+            self.flush_interval = flush_interval
+
+#   \brief - Describes a metric, which is shown on the metrics page even before anything has been recorded.
+
+#   \param name - The name of the metric, without the prefix.
+#   \param kind - "counter" or "histogram".
+#   \param description - What the metric measures.
+
+    def describe(self,name,kind,description):
+        with self.lock:
+            self.help[name] = (kind,description)
+
+#   \brief - Adds to a counter.
+
+#   \param name - The name of the counter.
+#   \param amount - The amount to add.
+#   \param labels - The labels of the counter.
+
+    def increment(self,name,amount=1,**labels):
+        key = (name,tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key,0)+amount
+            if self.client is not None:
+                self.add_pending(key,"value",amount)
+        self.maybe_flush()
+
+#   \brief - Records a value, usually a number of seconds, in a histogram.
+
+#   \param name - The name of the histogram.
+#   \param value - The value to record.
+#   \param labels - The labels of the histogram.
+
+    def observe(self,name,value,**labels):
+        key = (name,tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0]*len(default_buckets), 'sum': 0.0, 'count': 0}
+            for position, bound in enumerate(default_buckets):
+                if value <= bound:
+                    histogram['buckets'][position] += 1
+                    if self.client is not None:
+                        self.add_pending(key,position,1)
+            histogram['sum'] += value
+            histogram['count'] += 1
+            if self.client is not None:
+                self.add_pending(key,"sum",value)
+                self.add_pending(key,"count",1)
+        self.maybe_flush()
+
+#   \brief - Adds to the amount of a series waiting to be flushed to Redis. Must be called with the lock held.
+
+#   \param key - The name and labels of the metric.
+#   \param part - "value" for a counter, or the position of a bucket, "sum" or "count" for a histogram.
+#   \param amount - The amount to add.
+
+    def add_pending(self,key,part,amount):
+        series = (key[0],key[1],part)
+        self.pending[series] = self.pending.get(series,0)+amount
+
+#   \brief - Flushes the pending amounts to Redis if the flush interval has passed, unless another thread is already flushing them.
+    def maybe_flush(self):
+        if self.client is not None and time.monotonic()-self.flushed >= self.flush_interval:
+            self.flush(False)
+
+#   \brief - Adds the pending amounts to the totals in Redis.
+
+#   If Redis cannot be reached, the amounts are kept to be added by the next flush, so recording a metric never fails a request.
+
+#   \param wait - Whether to wait for a flush already in progress in another thread, rather than leaving the amounts to it.
+
+    def flush(self,wait=True):
+        if not self.flush_lock.acquire(blocking=wait):
+            return
+        try:
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+                self.flushed = time.monotonic()
+            if not pending:
+                return
+            try:
+                pipeline = self.client.pipeline(transaction=False)
+                for (name,labels,part), amount in pending.items():
+                    pipeline.hincrbyfloat("metrics:series",json.dumps([name,labels,part]),amount)
+                pipeline.execute()
+            except Exception:
+                with self.lock:
+                    for series, amount in pending.items():
+                        self.pending[series] = self.pending.get(series,0)+amount
+        finally:
+            self.flush_lock.release()
+
+#   \brief - Reads the totals of every process from Redis.
+
+#   \returns - The counters and histograms, in the same form as those kept in memory.
+
+    def read_shared(self):
+        self.flush()
+        counters = {}
+        histograms = {}
+        for field, total in self.client.hgetall("metrics:series").items():
+            name, labels, part = json.loads(field)
+            key = (name,tuple(tuple(label) for label in labels))
+            if part == "value":
+                counters[key] = float(total)
+                continue
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = {'buckets': [0]*len(default_buckets), 'sum': 0.0, 'count': 0}
+            if part == "sum":
+                histogram['sum'] = float(total)
+            elif part == "count":
+                histogram['count'] = int(float(total))
+            elif part < len(default_buckets):
+                histogram['buckets'][part] = int(float(total))
+        return counters, histograms
+
+#   \brief - Times the code inside a with statement, recording the time in a histogram even if the code raises an exception.
+
+#   \param name - The name of the histogram.
+#   \param labels - The labels of the histogram.
+
+    @contextmanager
+    def timer(self,name,**labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name,time.perf_counter()-start,**labels)
+
+#   \brief - Decorates a function so that every call to it is timed.
+
+#   \param name - The name of the histogram.
+#   \param labels - The labels of the histogram.
+
+    def timed(self,name,**labels):
+        def decorator(function):
+            @wraps(function)
+            def timed_function(*args,**kwargs):
+                with self.timer(name,**labels):
+                    return function(*args,**kwargs)
+            return timed_function
+        return decorator
+
+#   \brief - Returns every metric in the Prometheus text format.
+
+#   \param extra - A list of (name, kind, description, value) tuples for values which are read when the page is requested rather than recorded, eg. the feed cache counters.
+
+#   \returns - The metrics as a string.
+
+    def render(self,extra=()):
+        with self.lock:
+            help = dict(self.help)
+            counters = dict(self.counters)
+            histograms = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']} for key, value in self.histograms.items()}
+        if self.client is not None:
+            counters, histograms = self.read_shared()
+        lines = []
+        for name in sorted(help):
+            kind, description = help[name]
+            lines.append("# HELP "+self.prefix+name+" "+description)
+            lines.append("# TYPE "+self.prefix+name+" "+kind)
+            if kind == "counter":
+                for key in sorted(key for key in counters if key[0] == name):
+                    lines.append(self.prefix+name+format_labels(key[1])+" "+format_value(counters[key]))
+            else:
+                for key in sorted(key for key in histograms if key[0] == name):
+                    histogram = histograms[key]
+                    for bound, count in zip(default_buckets,histogram['buckets']):
+                        lines.append(self.prefix+name+"_bucket"+format_labels(key[1]+(("le",format_value(bound)),))+" "+str(count))
+                    lines.append(self.prefix+name+"_bucket"+format_labels(key[1]+(("le","+Inf"),))+" "+str(histogram['count']))
+                    lines.append(self.prefix+name+"_sum"+format_labels(key[1])+" "+format_value(histogram['sum']))
+                    lines.append(self.prefix+name+"_count"+format_labels(key[1])+" "+str(histogram['count']))
+        for name, kind, description, value in extra:
+            lines.append("# HELP "+self.prefix+name+" "+description)
+            lines.append("# TYPE "+self.prefix+name+" "+kind)
+            lines.append(self.prefix+name+" "+format_value(value))
+        return "\n".join(lines)+"\n"
+
+#   \brief - Formats the labels of a metric, escaping their values.
+
+#   \param labels - The tuple of (name, value) pairs.
+
+#   \returns - The labels in braces, or an empty string if there are none.
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{"+",".join(name+'="'+str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")+'"' for name, value in labels)+"}"
+
+#   \brief - Formats the value of a metric, without a trailing .0 on whole numbers.
+def format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+metrics = Metrics("smartrss_")
+metrics.describe("stage_seconds","histogram","Seconds spent in each stage of refreshing, loading and searching a user's feeds.")
+metrics.describe("template_render_seconds","histogram","Seconds spent rendering each template.")
+metrics.describe("feed_fetch_seconds","histogram","Seconds spent downloading a feed, by the feed's host.")
+metrics.describe("feed_bytes_total","counter","Bytes of feeds downloaded, by the feed's host.")
+metrics.describe("feed_fetches_total","counter","Feed downloads, by the feed's host and result.")
+
+#   \brief - Renders a template, timing how long it takes.
+
+#   \param template_name - The name of the template.
+#   \param context - The variables passed to the template.
+
+#   \returns - The rendered template.
+
+def render_template(template_name,**context):
+    with metrics.timer("template_render_seconds",template=template_name):
+        return flask_render_template(template_name,**context)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from . import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -37,3 +38,44 @@ class User(UserMixin, db.Model):
 #   \brief - Returns the user's username.
     def __repr__ (self):
         return self.name
+
+#   \brief - Model for support messages, in the support thread of the user who asked for support.
+class Message(db.Model):
+
+    __tablename__ = 'support-messages'
+    __table_args__ = (db.Index('support-messages-user-created', 'user_id', 'created_at'),) #Each user's thread is read newest first.
+
+    id = db.Column(db.Integer,
+                   primary_key=True)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('flasklogin-users.id'),
+                        nullable=False)
+    sender = db.Column(db.String(40),
+                       nullable=False,
+                       unique=False)
+    message = db.Column(db.Text,
+                        nullable=False)
+    created_at = db.Column(db.DateTime,
+                           index=True,
+                           unique=False,
+                           nullable=False,
+                           default=datetime.now)
+
+#   \brief - Model for alerts shown to a user the next time they view their dashboard.
+class Alert(db.Model):
+
+    __tablename__ = 'user-alerts'
+    __table_args__ = (db.Index('user-alerts-user-created', 'user_id', 'created_at'),)
+
+    id = db.Column(db.Integer,
+                   primary_key=True)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('flasklogin-users.id'),
+                        nullable=False)
+    alert = db.Column(db.Text,
+                      nullable=False)
+    created_at = db.Column(db.DateTime,
+                           index=False,
+                           unique=False,
+                           nullable=False,
+                           default=datetime.now)
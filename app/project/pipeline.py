@@ -0,0 +1,91 @@
+import hashlib
+from collections import Counter
+from .matching import normalise_entry, topic_words
+
+#   Turns fetched feeds into a snapshot in a single pass. Each feed flows through a chain of generators, one feed at a time, and the final stage builds the snapshot while computing its version and word counts, so nothing has to walk the whole snapshot again afterwards.
+
+#   \brief - Yields the stories of each feed, one feed at a time.
+
+#   \param feeds - A dictionary with a list for each outlet, containing the list of stories of each feed.
+
+#   \returns - A generator of the outlet, the feed's position within the outlet and the feed's list of stories.
+
+def iter_feeds(feeds):
+    for outlet in feeds:
+        for position, entries in enumerate(feeds[outlet]):
+            yield outlet, position, entries
+
+#   \brief - Yields the stories of each feed in an existing snapshot, one feed at a time.
+
+#   \param data - The data dictionary of the snapshot, with 'entries' and 'outlets'.
+
+#   \returns - A generator in the same form as iter_feeds().
+
+def iter_snapshot(data):
+    for outlet in data['outlets']:
+        for position, links in enumerate(data['outlets'][outlet]):
+            yield outlet, position, [data['entries'][link] for link in links]
+
+#   \brief - Finds the stories which have not been seen in an earlier feed, keeping a set of every link seen so far.
+
+#   \param feeds - A generator in the form of iter_feeds().
+
+#   \returns - A generator of the outlet, the feed's position, the list of the feed's links and the list of the feed's stories which have not been seen before.
+
+def unique_stories(feeds):
+    seen = set()
+    for outlet, position, entries in feeds:
+        links = []
+        new_entries = []
+        for entry in entries:
+            if entry['link'] not in seen: #Only the first story with each link is kept.
+                seen.add(entry['link'])
+                new_entries.append(entry)
+            links.append(entry['link'])
+        yield outlet, position, links, new_entries
+
+#   \brief - Counts the words in a story's title and summary, counting each word at most once per story however it is cased, along with how often each of its forms is used.
+
+#   \param entry - The normalised story.
+#   \param counts - The counter to which the words are added, under their case-folded form as the key.
+#   \param forms - The dictionary of counters to which the form of each word used in the story is added, under the word's case-folded form as the key.
+
+def count_words(entry,counts,forms):
+    topics = topic_words(entry)
+    counts.update(topics.keys())
+    for word, form in topics.items():
+        word_forms = forms.get(word)
+        if word_forms is None:
+            forms[word] = Counter((form,))
+        else:
+            word_forms[form] += 1
+
+#   \brief - Builds the data dictionary for a snapshot from the stories of each feed, storing each story only once.
+
+#   Stories are keyed by their link in 'entries'. 'outlets' holds a list for each outlet, containing a list of story links for each feed. 'version' is a hash which changes whenever the stories change, and is the same for the same stories however the snapshot was built. 'words' counts the words in the stories, for finding popular topics, and 'forms' counts how often each differently cased form of each word is used, so that topics are shown in their most popular form.
+
+#   \param feeds - A generator in the form of iter_feeds().
+
+#   \returns - The data dictionary.
+
+def build_snapshot(feeds):
+    data = {'entries': {}, 'outlets': {}, 'words': Counter(), 'forms': {}}
+    digest = hashlib.sha1()
+    last_outlet = None
+    for outlet, position, links, new_entries in unique_stories(feeds):
+        outlet_feeds = data['outlets'].setdefault(outlet,[])
+        while len(outlet_feeds) < position:
+            outlet_feeds.append([])
+        outlet_feeds.append(links)
+        for entry in new_entries:
+            entry = normalise_entry(dict(entry)) #Copy the story, since cached stories are shared with other users. Stories read from the archive are normalised here.
+            data['entries'][entry['link']] = entry
+            count_words(entry,data['words'],data['forms'])
+        if links and outlet != last_outlet: #Empty feeds are left out of the version, as they are not archived.
+            digest.update(outlet.encode()+b"\0")
+            last_outlet = outlet
+        for link in links:
+            entry = data['entries'][link]
+            digest.update(entry['link'].encode()+b"\0"+entry['title'].encode()+b"\0"+entry['summary'].encode()+b"\0")
+    data['version'] = digest.hexdigest()
+    return data
@@ -1,20 +1,31 @@
-import feedparser
 import os
 import csv
-from collections import Counter
 import re
 import json
-from datetime import datetime
+import hashlib
+import heapq
+import time
+from datetime import datetime, timedelta
 import warnings
-from flask import Flask, render_template, request, url_for, redirect, request, Blueprint, session, flash
+from flask import Flask, request, url_for, redirect, request, Blueprint, session, flash, jsonify, get_flashed_messages
 import urllib
 from flask_assets import Environment, Bundle
-from flask_login import current_user
+from flask_login import current_user, login_user
 from flask import current_app as app
-from .models import db, User
+from .models import db, User, Message, Alert
+from sqlalchemy import or_, and_
 from flask_login import login_required
 from shutil import copyfile
 from .forms import ChangePasswordForm, ChangeUsernameForm
+from .fetch import fetch_all, FeedCache, RedisFeedCache
+from .pipeline import build_snapshot, iter_feeds, iter_snapshot
+from .index import InvertedIndex, saved_revision
+from .matching import normalise
+from .cache import LRUCache, RedisCounters, MemoryCounters
+from .archive import write_snapshot, read_snapshot, read_links, write_rollup, read_trends, rollup_kinds, search_history
+from .jobs import RefreshQueue, RedisJobStore, MemoryJobStore
+from .storage import FileStore
+from .metrics import metrics, render_template
 from werkzeug.security import generate_password_hash, check_password_hash
 
 feeds_json_path = "feeds.json" #Define the path to the JSON file containing RSS feed URLS and outlet names.
@@ -22,11 +33,35 @@ default_feeds_json_path = "default_feeds.json"
 blacklist_path = "word_blacklist" #Define the path to the list of blacklisted common words.
 default_blacklist_path = os.path.join(app.root_path,"default_blacklist") #Define the path to the default list of blacklisted common words.
 archive_path = "archive" #Define the path to the directory containing archived RSS data.
+archive_db_path = "archive.db" #Define the path to the archive database, within the archive directory.
 issues_json_path = "tracked_issues.json" #Define the path to the tracked issues.
 default_issues_json_path = "default_issues.json"
-messages_path = "messages.json"
-all_messages_path = os.path.join(app.root_path,"all_messages.json")
-alerts_path = "alerts.json"
+messages_path = "messages.json" #Define the path to the user's support messages from before they were kept in the database.
+alerts_path = "alerts.json" #Define the path to the user's alerts from before they were kept in the database.
+message_date_format = "%B %d, %Y at %H:%M:%S"
+max_message_id = 2**63-1 #The largest id SQLite can store, beyond which looking up a message overflows.
+legacy_index_path = "index.json" #Define the path to the inverted index saved by earlier versions, within the archive directory. It is removed once the index is saved in the archive database.
+user_store = LRUCache(app.config['USER_STORE_SIZE']) #The RSS and analysis data of recently active users, under their user id as the key. Kept out of the session so it is not serialised on every request.
+user_cache = LRUCache(app.config['USER_CACHE_SIZE'],app.config['USER_CACHE_TTL']) #Detached copies of recently active users along with their credential stamp, under their user id as the key, so that loading the logged in user does not query the database on every request.
+if app.config['SHARED_STORE'] == "redis":
+    user_stamps = RedisCounters(app.config['SESSION_REDIS'],"user:stamp:") #Credential stamps of users, advanced whenever a user's name or password changes, kept in Redis so that every worker process stops serving its cached copy.
+    feed_list_stamps = RedisCounters(app.config['SESSION_REDIS'],"feeds:stamp:") #Advanced under "tracked" whenever any user's feed files change, so the ingester knows to read them again.
+else:
+    user_stamps = MemoryCounters()
+    feed_list_stamps = MemoryCounters()
+tracked_feeds_cache = {} #The stamp, time and set of feeds last read by tracked_feeds(), under the users directory as the key.
+if app.config['JOB_STORE'] == "redis":
+    refresh_jobs = RefreshQueue(RedisJobStore(app.config['SESSION_REDIS'],app.config['REFRESH_JOB_TIMEOUT'],app.config['REFRESH_CLAIM_LEASE']),app.config['REFRESH_WORKERS']) #Runs refreshes in the background, sharing their progress between worker processes through Redis.
+else:
+    refresh_jobs = RefreshQueue(MemoryJobStore(app.config['REFRESH_CLAIM_LEASE']),app.config['REFRESH_WORKERS'])
+if app.config['SHARED_STORE'] == "redis":
+    feed_cache = RedisFeedCache(app.config['SESSION_REDIS'],app.config['FEED_CACHE_SIZE']) #Feeds shared by every user, kept in Redis so that every worker process reads the feeds saved by the ingester.
+else:
+    feed_cache = FeedCache(app.config['FEED_CACHE_SIZE'])
+analysis_cache = LRUCache(app.config['ANALYSIS_CACHE_SIZE']) #Issue matches and popular topics, under a hash of the inputs they were computed from as the key, so users with the same feeds and issues share them.
+search_cache = LRUCache(app.config['SEARCH_CACHE_SIZE']) #The results of recent searches, under the version of the RSS data and the normalised search terms as the key, so users with the same feeds share them.
+storage = FileStore(app.config['FILE_CACHE_SIZE']) #Reads and writes the files in each user's directory.
+indexes = LRUCache(app.config['INDEX_CACHE_SIZE']) #The inverted indexes of recently active users, under their user id as the key.
 
 # Blueprint Configuration
 main_bp = Blueprint('main_bp', __name__ ,
@@ -43,6 +78,19 @@ def flash_form_errors(form):
         for err in error_messages:
             flash(err)
 
+#   \brief - Stops every worker process serving a cached copy of a user, by advancing their credential stamp.
+
+#   \param user_id - The id of the user.
+
+def forget_user(user_id):
+    user_stamps.advance(user_id)
+    user_cache.pop(user_id)
+
+#   \brief - Tells the ingester that the current user's feed files have changed, once they have been written.
+def forget_tracked_feeds():
+    storage.flush() #Written first, so the ingester never reads the old files under the new stamp.
+    feed_list_stamps.advance("tracked")
+
 #   \brief - Converts a local path from the project root into an absolute path.
 
 #   \param - The local path.
@@ -51,8 +99,7 @@ def flash_form_errors(form):
 
 def create_funcroot(path):
     funcroot = os.path.join(app.root_path,"users",str(current_user.id),path)
-    if not os.path.exists(funcroot):
-        os.makedirs(funcroot)
+    storage.ensure_dir(funcroot)
     return funcroot
 
 #   \brief - Reads a JSON file into a dictionary.
@@ -71,20 +118,20 @@ def read_json(json_path,is_dict=True,relative_path=True):
         funcroot = create_funcroot("")
     else:
         funcroot = ""
-    try:
-        json_file = open(os.path.join(funcroot,json_path),"r")
-    except FileNotFoundError:
+    text = storage.read(os.path.join(funcroot,json_path))
+    if text is None:
         if is_dict:
             content = {}
         else:
             content = []
     else:
-        content = json.loads(json_file.read())
-        json_file.close()
+        content = json.loads(text)
     return content
 
 #   \brief - Saves a dictionary in JSON format to an external file.
 
+#   During a request the file is written once the response is ready, so a file changed several times by one request is only written once.
+
 #   \param issues - The dictionary to be saved.
 #   \param json_path - The path to the file where the JSON data is to be saved.
 #   \param relative_path - True if the path is relative from the user's directory.
@@ -94,9 +141,7 @@ def write_json(data,json_path,relative_path=True):
         funcroot = create_funcroot("")
     else:
         funcroot = ""
-    json_file = open(os.path.join(funcroot,json_path),"w")
-    json_file.write(json.dumps(data, sort_keys=True, indent=4))
-    json_file.close()
+    storage.write(os.path.join(funcroot,json_path),json.dumps(data, sort_keys=True, indent=4))
     
 #   \brief - Sets the default user's tracked issues and feeds to the defaults.
     
@@ -104,25 +149,77 @@ def create_defaults():
     funcroot = create_funcroot("")
     copyfile(os.path.join(app.root_path,default_feeds_json_path),os.path.join(funcroot,default_feeds_json_path))
     copyfile(os.path.join(app.root_path,default_issues_json_path),os.path.join(funcroot,default_issues_json_path))
+    feed_list_stamps.advance("tracked") #The new user's default feeds are now tracked.
 
-#   \brief - Saves the data dictionary in JSON format.
+#   \brief - Appends the data dictionary to the user's archive database as a new snapshot.
 
-#   File name uses format <prefix>-<date>-<time>.json. This is saved in tracker.dat.
+#   Stories already archived are not stored again, and snapshots older than the ARCHIVE_RETENTION most recent are pruned.
 
 #   \param data - The data dictionary containing the RSS data.
 #   \param archive_path - The path to the archive directory.
-#   \param prefix - The prefix to the archive json file name - eg. "rss data".
+#   \param prefix - The prefix describing the snapshot - eg. "rss_data".
+
+#   \returns - The id of the new snapshot.
 
 def archive_json(data,archive_path,prefix):
     funcroot = create_funcroot(archive_path)
-    ts = datetime.now()
-    # dd/mm/YY H:M:S
-    ts_string = ts.strftime("%d.%m.%Y-%H:%M:%S")
-    file_name = prefix+"-"+ts_string+".json"
-    write_json(data,os.path.join(archive_path,file_name))
-    tracker_file = open(os.path.join(funcroot,"tracker.dat"),"w")
-    tracker_file.write(file_name) #Saves the name of the archive file in tracker.dat to be loaded automatically if read_default_archive() is called on the next run.
-    tracker_file.close()
+    return write_snapshot(os.path.join(funcroot,archive_db_path),data,prefix,app.config['ARCHIVE_RETENTION'])
+
+#   \brief - Saves the rollup of the user's latest snapshot to their archive database, for the trends page.
+
+#   \param data - The user's data, as returned by load(), whose RSS data has been archived by get_feeds().
+
+def archive_rollup(data):
+    feeds = data['feeds']
+    counts = {'issue': {issue: data['issues_data'][issue]['count'] for issue in data['issues_data']},
+              'outlet': {outlet: len(set(link for feed in feeds['outlets'][outlet] for link in feed)) for outlet in feeds['outlets']},
+              'word': dict(data['common_words'])}
+    funcroot = create_funcroot(archive_path)
+    with metrics.timer("stage_seconds",stage="rollup"):
+        write_rollup(os.path.join(funcroot,archive_db_path),feeds['snapshot_id'],len(feeds['entries']),counts,app.config['TREND_RETENTION_DAYS'])
+
+#   \brief - Reads the user's trends from the rollups in their archive database.
+
+#   \param kind - One of archive.rollup_kinds - "issue", "outlet" or "word".
+#   \param start - The earliest time to include, as a datetime, or None for no limit.
+#   \param end - The latest time to include, as a datetime, or None for no limit.
+#   \param names - The list of names to include, or None for every name.
+
+#   \returns - The snapshots and series, as returned by archive.read_trends().
+
+def get_trends(kind,start=None,end=None,names=None):
+    funcroot = create_funcroot(archive_path)
+    start = start and start.isoformat(timespec="seconds")
+    end = end and end.isoformat(timespec="seconds")
+    return read_trends(os.path.join(funcroot,archive_db_path),kind,start,end,names)
+
+#   \brief - Reads a time from a request's query string.
+
+#   \param value - The time as an ISO 8601 string, eg. "2022-10-01" or "2022-10-01T12:00:00", or None.
+#   \param end_of_day - True if a date without a time means the end of the day rather than its start.
+
+#   \returns - The time as a datetime, or None if no time was given.
+
+def parse_time(value,end_of_day=False):
+    if not value:
+        return None
+    time = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        time += timedelta(days=1,seconds=-1)
+    return time
+
+#   \brief - Returns the points of a line showing a series of counts, for drawing as an SVG polyline.
+
+#   \param counts - The list of counts.
+#   \param width - The width of the line's box.
+#   \param height - The height of the line's box.
+
+#   \returns - The points as a string of x,y pairs.
+
+def sparkline(counts,width=200,height=30):
+    top = max(max(counts,default=0),1)
+    step = width/max(len(counts)-1,1)
+    return " ".join(str(round(position*step,1))+","+str(round(height-count*height/top,1)) for position, count in enumerate(counts))
 
 #   \brief - Reads a JSON file into a dictionary for use as the RSS data file.
 
@@ -139,16 +236,21 @@ def read_archive_json(archive_path,file_name):
     archive_file.close()
     return data
 
-#   \brief - Reads the most recently generated JSON archive into a dictionary for use as the RSS data file.
+#   \brief - Reads the most recent snapshot in the user's archive database into a dictionary for use as the RSS data file.
 
-#   The name of this file is found in tracker.dat.
+#   Users whose archive predates the database fall back to the JSON archive named in tracker.dat, which is converted so that each story is stored once.
 
 #   \param archive_path - The path to the archive directory.
 
-#   \returns - The dictionary that all RSS feed contents has been written to from the JSON file.
+#   \returns - The dictionary that all RSS feed contents has been written to from the archive.
 
+@metrics.timed("stage_seconds",stage="read_archive")
 def read_default_archive(archive_path):
     funcroot = create_funcroot(archive_path)
+    if os.path.exists(os.path.join(funcroot,archive_db_path)):
+        data = read_snapshot(os.path.join(funcroot,archive_db_path))
+        if data is not None:
+            return build_snapshot(iter_snapshot(data)) #Compute the version and word counts in the same pass as a refresh would.
     try:
         tracker_file = open(os.path.join(funcroot,"tracker.dat"),"r")
     except FileNotFoundError:
@@ -156,7 +258,7 @@ def read_default_archive(archive_path):
     else:
         data = read_archive_json(archive_path,tracker_file.read())
         tracker_file.close()
-    return data
+    return build_snapshot(iter_feeds(data)) #JSON archives store every story under each feed it appeared in.
 
 #   \brief - Reads the file of blacklisted common words into a list.
 
@@ -167,10 +269,101 @@ def read_default_archive(archive_path):
 def read_blacklist(blacklist_path):
     funcroot = create_funcroot("")
     fullpath = os.path.join(funcroot,blacklist_path)
-    if not os.path.exists(fullpath):
-        copyfile(default_blacklist_path,fullpath)
-    blacklist_file = open(fullpath,"r")
-    return blacklist_file.read().split("\n")
+    blacklist = storage.read(fullpath)
+    if blacklist is None:
+        blacklist = storage.read(default_blacklist_path)
+        storage.write(fullpath,blacklist)
+    return blacklist.split("\n")
+
+#   \brief - Returns the user's inverted index, reading it from the archive database if another process has saved it since it was last read.
+
+#   If the user has no saved index yet, one is built from the supplied data and saved, and any index left by an earlier version in index.json is removed.
+
+#   \param data - The data dictionary containing the RSS data, used only if there is no saved index.
+
+#   \returns - The user's inverted index.
+
+def get_index(data=None):
+    funcroot = create_funcroot(archive_path)
+    revision = saved_revision(os.path.join(funcroot,archive_db_path))
+    if revision is None:
+        legacy_path = os.path.join(funcroot,legacy_index_path)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        index = InvertedIndex()
+        index.update(data or build_snapshot(iter_feeds({})))
+        save_index(index)
+        return index
+    index = indexes.get(current_user.id)
+    if index is None or index.revision != revision:
+        index = InvertedIndex.load(os.path.join(funcroot,archive_db_path))
+        indexes.put(current_user.id,index)
+    return index
+
+#   \brief - Saves the changes to the user's inverted index in their archive database, straight away so that its revision can be recorded.
+
+#   \param index - The user's inverted index.
+
+@metrics.timed("stage_seconds",stage="save_index")
+def save_index(index):
+    index.save(os.path.join(create_funcroot(archive_path),archive_db_path))
+    indexes.put(current_user.id,index)
+
+#   \brief - Returns a page of support messages, newest first.
+
+#   Pages are found from the last message of the previous page rather than an offset, so each page is read straight from the (user_id, created_at) index however far back it is.
+
+#   \param query - The query selecting the messages to be paged through.
+#   \param before - The id of the last message of the previous page, or None for the first page.
+#   \param page_size - The number of messages on each page.
+
+#   \returns messages - The list of messages on the page.
+#   \returns next_before - The id to pass as before to get the next page, or None if this is the last page.
+
+def message_page(query,before,page_size):
+    if before is not None and 0 < before <= max_message_id: #Other ids cannot belong to a message, so they give the first page like any unknown id.
+        cursor = db.session.get(Message,before)
+        if cursor is not None:
+            query = query.filter(or_(Message.created_at < cursor.created_at, and_(Message.created_at == cursor.created_at, Message.id < cursor.id)))
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(page_size+1).all() #Fetch one extra message to find out if there is another page.
+    if len(messages) > page_size:
+        return messages[:page_size], messages[page_size-1].id
+    return messages, None
+
+#   \brief - Moves every user's support messages and alerts from their JSON files into the database.
+
+#   Run once when the app starts, so the admin support pages show every user's messages straight away. Each file is claimed by renaming it before it is read, so that when several processes start at once only one of them imports it. A file which cannot be imported is put back and logged, to be tried again on the next start.
+
+#   \param users_root - The path to the directory containing every user's directory.
+
+def import_legacy_support(users_root):
+    try:
+        user_dirs = os.listdir(users_root)
+    except FileNotFoundError:
+        return
+    for user_dir in user_dirs:
+        if not user_dir.isdigit():
+            continue
+        for legacy_path in (messages_path,alerts_path):
+            path = os.path.join(users_root,user_dir,legacy_path)
+            claimed_path = path+".importing"
+            try:
+                os.rename(path,claimed_path)
+            except FileNotFoundError:
+                continue #There is no such file, or another process has claimed it.
+            try:
+                for row in read_json(claimed_path,False,False):
+                    if legacy_path == messages_path:
+                        db.session.add(Message(user_id=int(user_dir), sender=row['sender'], message=row['message'], created_at=datetime.strptime(row['date'],message_date_format)))
+                    else:
+                        db.session.add(Alert(user_id=int(user_dir), alert=row))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                os.rename(claimed_path,path)
+                app.logger.exception("Could not import "+path)
+                continue
+            os.remove(claimed_path)
 
 #   \brief - Adds a new key and its values to the container dictionary or edits the existing ones for the key.
 
@@ -206,224 +399,144 @@ def get_active_defaults(defaults):
             active_defaults[name] = defaults[name][0]
     return active_defaults
 
-#   \brief - Removes HTML code from string.
-
-#   \param raw - String from which the HTML code is to be removed.
-
-def clean_html(raw):
-    clean_regex = re.compile('<.*?>')
-    clean = re.sub(clean_regex, '', raw)
-    return clean
-
-#    \brief - Iterates through the JSON of RSS feed URLs and writes all contents to a dictionary.
-
-#    Creates a separate list for each outlet within the dictionary.
-    
-#   \returns data - The dictionary that all RSS feed contents have been written to.
-
-def get_feeds():
-    all_feeds = {**session.get('feeds_list'),**session.get('active_default_feeds')}
-    data={} #Creates the local dictionary that RSS data will be written to.
-    for outlet in all_feeds:
-        data[outlet] = []
-        for feed in all_feeds[outlet]:
-            try:
-                feed_data = feedparser.parse(feed) #Save the RSS feed data.
-                feed_data.feed.link #Check that the feed has been saved properly.
-            except Exception:
-                flash(feed+" is not a working RSS link, skipping.") #Flash this to the user if the try statement fails.
-            else:
-                trunc_feed_data = []
-                for entry in feed_data.entries:
-                    entry_data = {}
-                    entry_data['title'] = entry.title
-                    try:
-                        entry_data['summary'] = clean_html(entry.summary)
-                    except AttributeError:
-                        entry_data['summary'] = ""
-                    entry_data['link'] = entry.link
-                    try:
-                        entry_data['published'] = entry.published
-                    except AttributeError:
-                        entry_data['published'] = "" #Takes only necessary attributes from stories.
-                    trunc_feed_data.append(entry_data)
-                data[outlet].append(trunc_feed_data) #Append the data to the list with the key of the name of the outlet in the data dictionary.
-    archive_json(data,archive_path,"rss_data") #Archive the rss data.
-    return data; #Loops through the list of feed URLS and writes the contents of each respective RSS feed to a dictionary with the feed title has the key, returning this dictionary.
-
-#   \brief - Returns a regular expression object to test if the given word is present as a whole word in the tested string.
-
-#   \param word - The word to be searched for.
-
-#   \returns - A regular expression object to test if the given word is present as a whole word in the tested string.
-
-def whole_word(word):
-    return re.compile(r'\b({0})\b'.format(word), flags=re.IGNORECASE).search
+#   \brief - Returns the set of every feed URL tracked by any user, including their active default feeds.
 
-#   \brief - Returns the search ranking of an entry with respect to the terms supplied.
+#   Reads every user's feed files, so the ingester reads it through tracked_feeds().
 
-#   Ranking criteria:
-#   Base of 0 (no matches in title or summary).
-#   +2 For every term matched in the title.
-#   +1 For every term matched in the summary.
+#   \param users_root - The path to the directory containing every user's directory.
 
-#   \param terms - The list of terms to be matched within the entry.
-#   \param entry - The entry for the term to be matched with.
+#   \returns - The set of feed URLs.
 
-#   \returns - The ranking of the entry.
-
-def rank_entries(terms, entry):
-    rank = 0
-    for term in terms:
-        nopunc_term = re.sub(r'[^\w\s]','',term.lower()) #Strips punctuation from the search term and makes it lower case.
-        try:
-            nopunc_title = re.sub(r'[^\w\s]','',entry['title'].lower()) #Strips punctuation from the title and makes it lower case.
-        except KeyError:
-            entry['title'] = ""
-            nopunc_title = ""
-        try:
-            nopunc_summary = re.sub(r'[^\w\s]','',entry['summary'].lower()) #Strips punctuation from the summary and makes it lower case.
-        except KeyError:
-            entry['summary'] = ""
-            nopunc_summary = ""
-        test_whole_word = whole_word(nopunc_term)
-        if test_whole_word(nopunc_title): #Checks if the word is present as a whole word in the title.
-            rank += 2
-        if test_whole_word(nopunc_summary): #Checks if the word is present as a whole word in the summary.
-            rank += 1
-    return rank
-
-#   \brief - Returns whether the an entry already in the outlet's list links to the same article as a new entry.
+def all_tracked_feeds(users_root):
+    feeds = set()
+    try:
+        user_dirs = os.listdir(users_root)
+    except FileNotFoundError:
+        return feeds
+    for user_dir in user_dirs:
+        feeds_list = read_json(os.path.join(users_root,user_dir,feeds_json_path),True,False)
+        default_feeds_list = read_json(os.path.join(users_root,user_dir,default_feeds_json_path),True,False)
+        all_feeds = {**feeds_list,**get_active_defaults(default_feeds_list)}
+        for outlet in all_feeds:
+            feeds.update(all_feeds[outlet])
+    return feeds
 
-#   \param entries - The list of entries.
-#   \param candidate - The new entry to be checked for a match with another entry.
+#   \brief - Returns the set of every feed URL tracked by any user, only reading every user's feed files again once one of them has changed.
 
-#   \returns Whether the new entry has the same link as an entry already present in the list (boolean).
+#   The files are also read again once poll_interval seconds have passed, in case they were changed by a process which does not share the stamp, eg. another worker process when the memory store is used.
 
-def unique_entry(entries,candidate):
-    for entry in entries:
-        if entry['link'] == candidate['link']:
-            return False #Returns False if the candidate entry has the same link as an entry already present in the list.
-    return True
+#   \param users_root - The path to the directory containing every user's directory.
+#   \param poll_interval - The most seconds the set is reused for.
 
-#   \brief - Returns the ranking from an entry.
+#   \returns - The set of feed URLs.
 
-#   \param entry - The entry containing the ranking.
+def tracked_feeds(users_root,poll_interval):
+    stamp = feed_list_stamps.get("tracked") #Read before the files, so that a change made while reading them causes another read.
+    cached = tracked_feeds_cache.get(users_root)
+    if cached is not None and cached[0] == stamp and time.time()-cached[1] < poll_interval:
+        return cached[2]
+    feeds = all_tracked_feeds(users_root)
+    tracked_feeds_cache[users_root] = (stamp,time.time(),feeds)
+    return feeds
 
-#   \returns - The ranking for the entry.
+#    \brief - Iterates through the JSON of RSS feed URLs and writes all contents to a dictionary.
 
-def return_ranking(entry):
-    return entry['ranking']
+#    Each story is stored once under its canonical link in data['entries']. data['outlets'] holds a separate list for each outlet, containing the links of the stories in each of its feeds.
 
+#    When background ingestion is enabled, feeds are read from the latest ingested snapshot in the feed cache and only feeds which have not been ingested yet are downloaded.
 
-#   \brief - Loops through the data dictionary containing the RSS data, checking if each individual entry matches any of the key terms in a supplied list.
+#   \param archive - True if the data is to be archived.
+#   \param progress - A function taking keyword arguments which is told how many feeds of each outlet have been fetched and what stage the refresh has reached, or None.
 
-#   Copies all matching entries to separate lists for each outlet within a separate dictionary. Counts the number of entries matched.
+#   \returns data - The dictionary that all RSS feed contents have been written to.
 
-#   Entries are also ranked per outlet based on how many terms match them. 
+def get_feeds(archive=True,progress=None):
+    all_feeds = {**session.get('feeds_list'),**session.get('active_default_feeds')}
+    if app.config['INGEST_ENABLED']:
+        ttl = float("inf") #The ingestion thread keeps cached feeds up to date, so they never need revalidating here.
+    else:
+        ttl = app.config['FEED_CACHE_TTL']
+    generation = feed_cache.generation() #Read before fetching, so that feeds changed while fetching cause another rebuild.
+    feed_progress = None
+    if progress is not None:
+        outlets = {outlet: {'done': 0, 'total': len(all_feeds[outlet])} for outlet in all_feeds}
+        progress(stage="fetching", outlets=outlets)
+        def feed_progress(outlet,feed):
+            outlets[outlet]['done'] += 1
+            progress(outlets=outlets)
+    with metrics.timer("stage_seconds",stage="fetch"):
+        fetched, failed, slow = fetch_all(all_feeds,app.config['FEED_FETCH_WORKERS'],app.config['FEED_TIMEOUT'],app.config['FEED_DEADLINE'],feed_cache,ttl,feed_progress) #Download all feeds at the same time, reusing feeds already fetched for other users.
+    for feed in failed:
+        flash(feed+" is not a working RSS link, skipping.") #Flash this to the user if the feed could not be fetched or parsed.
+    for feed in slow:
+        flash(feed+" took too long to respond, skipping.") #Flash this to the user if the feed did not finish before the deadline.
+    with metrics.timer("stage_seconds",stage="snapshot"):
+        data = build_snapshot(iter_feeds(fetched)) #Store each story once, however many of the user's feeds it appears in, computing the version and word counts as the stories go past.
+    data['generation'] = generation
+    if archive:
+        if progress is not None:
+            progress(stage="archiving")
+        with metrics.timer("stage_seconds",stage="archive"):
+            data['snapshot_id'] = archive_json(data,archive_path,"rss_data") #Archive the rss data, remembering the snapshot so its rollup can be saved once the issues have been matched.
+    with metrics.timer("stage_seconds",stage="index"):
+        index = get_index()
+        index.update(data) #Index only the stories which have not been seen before. The index is saved once the issues have been matched in load().
+        if app.config['ARCHIVE_RETENTION'] > 0:
+            index.prune(read_links(os.path.join(create_funcroot(archive_path),archive_db_path))) #Forget stories which are no longer in any snapshot kept in the archive.
+    return data; #Fetches every RSS feed at once and writes the contents of each respective RSS feed to a dictionary, returning this dictionary.
+
+#   \brief - Finds the entries in the current snapshot which match any of the key terms in a supplied list, using the user's inverted index.
+
+#   Entries are ranked based on how many terms match them. 
 
 #   \param terms - The list containing the key terms to be matched.
-#   \param data - The data dictionary containing all the RSS data.
+#   \param index - The inverted index of the user's RSS data.
 
-#   \returns matched_data - The separate dictionary containing separate lists for each outlet stored at the key, which is the outlet's name, which have matched at least one of the terms.
-#   \returns count - The number of entries matched.
+#   \returns - The unsorted list of results, as returned by InvertedIndex.search().
 
-def search_key_phrases(terms, data):
-    count = 0
-    matched_data = {}
-    for outlet in data:
-        for feed in data[outlet]:
-            for entry in feed: #Loop through all invidual entries.
-                ranking = rank_entries(terms, entry) #Find ranking of the entry.
-                if ranking != 0: #Check if the entry matches any of the key word.
-                    entry['ranking'] = ranking #Add the ranking under the "ranking" key in the entry.
-                    try:
-                        matched_data[outlet]
-                    except KeyError:
-                        matched_data[outlet] = [] #Create list for an outlet using its name as a key if it doesn't already exist in the matched_data dictionary.
-                    if (unique_entry(matched_data[outlet], entry)):
-                        matched_data[outlet].append(entry) #Append the list for the entry's outlet with the entry if the entry is unique.
-                        count += 1
-        try:
-            matched_data[outlet]
-        except KeyError:
-            break
-        else:
-            matched_data[outlet].sort(key=return_ranking, reverse=True)
-            for entry in matched_data[outlet]:
-                del entry['ranking'] #If there are returned entries for the outlet, sort entries in ascending order of ranking, and then remove the ranking once it is no longer needed.
-    return matched_data, count
+def search_key_phrases(terms, index):
+    return index.search(terms)
 
-#   \brief - Returns the count from a word and word count pair.
+#   \brief - Constructs a list of the most common words found in titles and descriptions, in descending order of frequency alongside their frequency.
 
-#   \param elem - The list containing the word and word count.
+#   Each word is counted at most once per story, however it is cased, and is shown in its most popular form, with the counts of its other forms added on to it. Blacklisted words are left out.
 
-#   \returns - The word count for the word.
+#   \param data - The data dictionary containing all the fetched RSS data, as built by build_snapshot().
+#   \param blacklist - The list containing all the blacklisted (too common in English) words.
+#   \param top - The number of words to be returned.
 
-def return_count(elem):
-    return elem[1]
+#   \returns - A 2D list - the list of words, paired with their frequency. 
 
-#   \brief - Creates a new list, into which the list of words and counts is read, but different-case instances of the same words are removed.
+def most_common_phrases(data, blacklist, top=10):
+    blacklist = frozenset(word.strip().casefold() for word in blacklist)
+    words = heapq.nsmallest(top, ((-count, word) for word, count in data['words'].items() if word not in blacklist)) #Ties are in alphabetical order, so every worker gives the same list.
+    return [[min(data['forms'][word].items(), key=lambda form: (-form[1],form[0]))[0], -count] for count, word in words] #Ties between forms are also in alphabetical order.
 
-#   The most common instance of the word is used and the counts for the other instances added on to its count.
+#   \brief - Returns a key for the analysis cache from the inputs an analysis result was computed from.
 
-#   \param words - The 2D list containing words and counts.
-#   \param ranked - True if the words are in a pair with a ranking, False if they are simply strings alone in a list.
+#   \param parts - The inputs, which must be serialisable as JSON.
 
-#   \returns - The new list with all different-case instances merged as described above. 
+#   \returns - A hash of the inputs.
 
-def rm_diff_case_repeats(words,ranked=True):
-    new_words = []
-    i=0
-    while i < len(words): #Loop through all words.
-        x=i+1
-        if ranked:
-            new_words.append([words[i][0],words[i][1]]) #Copy each word into new_words.
+def analysis_key(*parts):
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
 
-        while x < len(words): #Check each word against every word after itself.
-            if ranked:
-                if words[i][0].lower() == words[x][0].lower():
-                    new_words[i][1] += words[x][1]
-                    words.pop(x) #If two words have the same spelling but different case, remove the less popular word from the words list and add its count onto the more popular word's count in the new_words list.
-                x+=1
-            else:
-                if words[i].lower() == words[x].lower():
-                    print(words[i])
-                    words.pop(x)
-                x+=1
-        i+=1
-    if ranked:
-        new_words.sort(key=return_count,reverse=True) #Sort new_words in descending order of word count.
-        return new_words
-    else:
-        return words
+#   \brief - Returns the most common words in the RSS data, computing them only if no user with the same data and blacklist has done so recently.
 
-#   \brief - Constructs a list containing all words found in titles and descriptions, then sorts them in descending order of frequency alongside their frequency.
+#   \param data - The data dictionary containing all the fetched RSS data.
+#   \param version - The version of the RSS data, as computed by build_snapshot().
+#   \param blacklist - The list containing all the blacklisted words.
 
-#   \param data - The data dictionary containing all the fetched SRSS data.
-#   \param blacklist - The list containing all the blacklisted (too common in English) words.
+#   \returns - The list of words paired with their frequency, as returned by most_common_phrases().
 
-#   \returns new_words - A 2D list - the list of words, paired with their frequency. 
-
-def most_common_phrases(data, blacklist):
-    all_words = []
-    for outlet in data:
-        for feed in data[outlet]:
-            for entry in feed:
-                add_words = re.sub(r'[^\w\s-]','',entry['title']).split()+re.sub(r'[^\w\s-]','',entry['summary']).split()
-                add_words = rm_diff_case_repeats(add_words,False) #Remove repeated words from the list to be added.
-                all_words += add_words #Reads all words found in titles and descriptions into a list, removing all punctuation marks. Repeats in a single story are not counted.
-    words = (Counter(all_words).most_common()) #Gets words into a 2d list alongside their respective frequencies in all_words, as well as sorting them in decreasing order of frequency.
-    i=0
-    while i < len(words): #Remove all words which are in the blacklist from the list.
-        for word in blacklist:
-            if words[i][0].lower() == word.strip():
-                words.pop(i)
-                i -= 1
-                break
-        i += 1
-    words = rm_diff_case_repeats(words)
-    return words
+@metrics.timed("stage_seconds",stage="common_words")
+def get_common_words(data,version,blacklist):
+    key = analysis_key("common_words",version,sorted(set(word.strip() for word in blacklist)))
+    common_words = analysis_cache.get(key)
+    if common_words is None:
+        common_words = most_common_phrases(data,blacklist)
+        analysis_cache.put(key,common_words)
+    return common_words
 
 #   \brief - Uses two dictionaries to create a two-way mapping between an issue name and a safe version of the name which can be used in a URL.
 
@@ -438,74 +551,216 @@ def create_safe_mapping(issue,safe_to_string,string_to_safe):
 
 #   \brief - Iterates through each issue in the issues dictionary and returns a dictionary containing the stories (within another dictionary under their outlets as keys) which match their tags and the number of stories for each issue.
 
+#   Matches are kept in the index, so only stories added since the last call are matched, and an issue is matched against every story again only when its tags change.
+
 #   Also creates two dictionaries comprising a two-way mapping between each issue name and a safe version of the name which can be used in a URL.
 
+#   Issues whose tags are matched against the same RSS data by another user, such as the default issues, are shared through the analysis cache and not matched again.
+
 #   \param issues - The dictionary of tracked issues - each list of tags under the issue name as their key.
-#   \param data - The data dictionary containing all the RSS data. 
+#   \param index - The inverted index of the user's RSS data.
+#   \param feeds - The data dictionary containing the RSS data the issues are matched against, as built by build_snapshot().
 
 #   \returns issues_data - The dictionary containing the stories and number of stories for each issue.
 #   \returns safe_to_string - The dictionary which uses the safe version of the issue name as the key and the original issue name as the value.
 #   \returns string_to_safe - The dictionary which uses the original issue name as the key and the safe version of the issue name as the value.
 
 
-def get_issues(issues,data):
+@metrics.timed("stage_seconds",stage="match_issues")
+def get_issues(issues,index,feeds):
     issues_data = {}
     safe_to_string = {}
     string_to_safe = {}
-    for issue in issues:
-        create_safe_mapping(issue,safe_to_string,string_to_safe)
-        count = 0
-        matched_data, count = search_key_phrases(issues[issue],data) #Find the articles with titles or descriptions matching the issue tags.
-        issues_data[issue] = {}
-        issues_data[issue]['data'] = matched_data
-        issues_data[issue]['count'] = count
+    with index.pinned(feeds): #Match against the snapshot the results are cached under, even if a refresh has moved the index on since.
+        for issue in issues:
+            create_safe_mapping(issue,safe_to_string,string_to_safe)
+            count = 0
+            key = analysis_key("issue",feeds['version'],issues[issue])
+            result = analysis_cache.get(key)
+            if result is None:
+                result = index.match_issue(issue,issues[issue]) #Find the articles with titles or descriptions matching the issue tags, only matching articles which are new since the issue was last matched.
+                analysis_cache.put(key,result)
+            matched_data, count = result
+            issues_data[issue] = {}
+            issues_data[issue]['data'] = matched_data
+            issues_data[issue]['count'] = count
+        index.forget_issues(issues)
+        if index.dirty:
+            save_index(index) #Save the index along with the new matches, so they are not matched again on the next login.
     return issues_data, safe_to_string, string_to_safe
 
-#   \brief - Splits the search term into an array of its different words before finding matching stories from the RSS data.
+#   \brief - Splits the search term into an array of its different words before finding a page of matching stories from the RSS data.
+
+#   The matches for each search are kept in the search cache under the version of the RSS data and the normalised words, so a search repeated by any user with the same data, such as a popular topic clicked on the dashboard, is not matched again. Only the stories on the requested page are picked out of the matches, using a heap rather than sorting every match.
 
 #   \param term - The search term entered by the user.
-#   \param data - The data dictionary containing the RSS data.
+#   \param data - The user's data, as returned by get_user_data().
+#   \param page - The number of the page of results, starting from 1.
 
-#   \returns matched_data - The separate dictionary containing separate lists for each outlet stored at the key which is the outlet's name which have matched at least one of the terms.
+#   \returns matched_data - The dictionary containing a list for each outlet, in their original order, of the stories on the page in descending order of ranking.
 #   \returns count - The number of entries matched.
+#   \returns page - The number of the page returned, which is the nearest page to the one requested.
+#   \returns pages - The number of pages of results.
+
+@metrics.timed("stage_seconds",stage="search")
+def search(term, data, page=1):
+    terms = tuple(sorted(normalise(word)[0] for word in term.split())) #The order of the words does not change the rankings.
+    key = (data['version'],terms)
+    results = search_cache.get(key)
+    if results is None:
+        with get_index(data['feeds']).pinned(data['feeds']) as index: #A refresh may have moved the index on to a newer snapshot than the one the results are shown from.
+            results = search_key_phrases(list(terms), index)
+        search_cache.put(key,results)
+    page_size = app.config['SEARCH_PAGE_SIZE']
+    pages = max(1,-(-len(results)//page_size))
+    page = min(max(1,page),pages)
+    top = heapq.nsmallest(page*page_size, results)[(page-1)*page_size:] #Picks the best results up to the end of the page, without sorting the rest.
+    matched_data = {}
+    for ranking, outlet_position, position, outlet, link in sorted(top, key=lambda result: result[1]): #Sorting is stable, so stories stay in order of ranking within each outlet.
+        matched_data.setdefault(outlet,[]).append(data['feeds']['entries'][link])
+    return matched_data, len(results), page, pages
+
+#   \brief - Finds a page of stories matching any word of the search term among every story the user has ever archived.
+
+#   The search is answered from the full-text index in the user's archive database, so neither its speed nor its memory use depends much on how long the history is.
+
+#   \param term - The search term entered by the user.
+#   \param page - The number of the page of results, starting from 1.
+
+#   \returns entries - The list of stories on the page, best matches first.
+#   \returns page - The number of the page returned.
+#   \returns has_next - True if there is another page of results.
+
+@metrics.timed("stage_seconds",stage="search_history")
+def search_all_history(term,page=1):
+    words = re.findall(r'\w+', term.casefold()) #Split into words the same way as the full-text index.
+    last_page = -(-app.config['HISTORY_SEARCH_CANDIDATES']//app.config['SEARCH_PAGE_SIZE']) #Only the most recent candidates are ranked, so later pages are always empty.
+    page = min(max(1,page),last_page) #Larger pages would also overflow the offset of the query.
+    funcroot = create_funcroot(archive_path)
+    entries, has_next = search_history(os.path.join(funcroot,archive_db_path),words,page,app.config['SEARCH_PAGE_SIZE'],app.config['HISTORY_SEARCH_CANDIDATES'])
+    return entries, page, has_next
+
+#   \brief - Matches the user's tracked issues again after they have been changed, without reloading the RSS data.
+
+#   Only issues whose tags have changed are matched against every story.
+
+def reload_issues():
+    data = get_user_data()
+    data['issues_data'], data['safe_to_string'], data['string_to_safe'] = get_issues({**session.get('issues'),**session.get('active_default_issues')},get_index(data['feeds']),data['feeds'])
+    user_store.put(current_user.id,data)
+
+#   \brief - Returns the current user's RSS and analysis data from the server-side store.
+
+#   Only the version of the data is kept in the session. If this process does not hold that version, for example because the user logged in through another worker or the data was evicted, it is rebuilt from the user's archive. With background ingestion, the data is also rebuilt from the latest ingested feeds once the feed cache's generation has moved on from the one the data was built from.
 
-def search(term, data):
-    terms = term.split()
-    return search_key_phrases(terms, data)
+#   \returns - The dictionary containing the RSS data under 'feeds', the tracked issues data under 'issues_data', the issue name mappings under 'safe_to_string' and 'string_to_safe', and the popular topics under 'common_words'.
+
+def get_user_data():
+    data = user_store.get(current_user.id)
+    if data is None or data['version'] != session.get('data_version'):
+        data = basic_load()
+    elif app.config['INGEST_ENABLED'] and data['generation'] != feed_cache.generation():
+        data = basic_load()
+    return data
 
 #   \brief - Loads the top issues and tracked issues data.
 
-#   \param data - The data dictionary containing the RSS data.
+#   The results are saved in the server-side store rather than the session.
+
+#   \param feeds - The data dictionary containing the RSS data.
 
-def load():
-    session['messages'] = read_json(messages_path,False)
-    session['blacklist'] = read_blacklist(blacklist_path)
+#   \returns - The user's data, as returned by get_user_data().
+
+@metrics.timed("stage_seconds",stage="load")
+def load(feeds):
     session['issues'] = read_json(issues_json_path)
     session['default_issues'] = read_json(default_issues_json_path)
     session['active_default_issues'] = get_active_defaults(session['default_issues'])
-    session['issues_data'], session['safe_to_string'], session['string_to_safe'] = get_issues({**session.get('issues'),**session.get('active_default_issues')},session.get('feeds'))
-    common_words = most_common_phrases(session.get('feeds'),session.get('blacklist'))
-    del common_words[10:]
-    session['common_words'] = common_words
+    blacklist = read_blacklist(blacklist_path)
+    data = {'feeds': feeds, 'version': feeds['version'], 'generation': feeds.get('generation')} #Snapshots read from the archive have no generation, so they are always replaced by ingested feeds.
+    data['issues_data'], data['safe_to_string'], data['string_to_safe'] = get_issues({**session.get('issues'),**session.get('active_default_issues')},get_index(feeds),feeds)
+    data['common_words'] = get_common_words(feeds,data['version'],blacklist)
+    user_store.put(current_user.id,data)
+    session['data_version'] = data['version']
+    return data
 
-#   \brief - Loads the RSS data from the most recent archive and generates the top issues and tracked issues data from that.
+#   \brief - Loads the RSS data from the most recent archive, or the latest ingested snapshot if background ingestion is enabled, and generates the top issues and tracked issues data from that.
 
+#   \returns - The user's data, as returned by get_user_data().
+
+@metrics.timed("stage_seconds",stage="basic_load")
 def basic_load():
     session['feeds_list'] = read_json(feeds_json_path) #Reads the feeds in from the supplied JSON file into a dictionary under the outlet as the key.
     session['default_feeds_list'] = read_json(default_feeds_json_path)
     session['active_default_feeds'] = get_active_defaults(session['default_feeds_list'])
-    session['feeds'] = read_default_archive(archive_path)
-    load()
+    if app.config['INGEST_ENABLED']:
+        feeds = get_feeds(False)
+    else:
+        feeds = read_default_archive(archive_path)
+    return load(feeds)
 
 #   \brief - Refreshes the RSS data, top issues and data found for tracked issues from the tracked RSS feeds.
 
-def refresh():
+#   \param progress - A function taking keyword arguments which is told how far the refresh has got, or None.
+
+#   \returns - The user's data, as returned by get_user_data().
+
+@metrics.timed("stage_seconds",stage="refresh")
+def refresh(progress=None):
     session['feeds_list'] = read_json(feeds_json_path) #Reads the feeds in from the supplied JSON file into a dictionary under the outlet as the key.
     session['default_feeds_list'] = read_json(default_feeds_json_path)
     session['active_default_feeds'] = get_active_defaults(session['default_feeds_list'])
-    session['feeds'] = get_feeds()
-    load()
+    feeds = get_feeds(True,progress)
+    if progress is not None:
+        progress(stage="analysing")
+    data = load(feeds)
+    archive_rollup(data)
+    return data
+
+#   \brief - Queues a refresh of the current user's feeds to run in the background, unless one is already in flight.
+
+#   The refresh runs in its own request context, logged in as the user, so the same functions can be used as for a refresh during a request. Messages it flashes are saved in the job's status, to be flashed to the user once the refresh has finished.
+
+#   \returns - The status of the refresh, and True if a new refresh was queued.
+
+def queue_refresh():
+    real_app = app._get_current_object()
+    user_id = current_user.id
+    def job(progress):
+        with real_app.test_request_context():
+            login_user(db.session.get(User,user_id))
+            try:
+                data = refresh(progress)
+            finally:
+                storage.flush() #Write the files changed before a failure too, as a request would.
+            return {'version': data['version'], 'messages': get_flashed_messages()}
+    return refresh_jobs.enqueue(user_id,job)
 
+#   \brief - Returns the status of the current user's latest refresh.
+
+#   Once a refresh has finished, its messages are flashed to the user, the user is moved on to the refreshed data and the status is cleared.
+
+#   \returns - The status of the refresh, or None if the user has no refresh in flight.
+
+def get_refresh_status():
+    status = refresh_jobs.status(current_user.id)
+    if status is not None and status['state'] in ("done","failed"):
+        for message in status['messages']:
+            flash(message)
+        if status['state'] == "done":
+            session['data_version'] = status['version']
+        refresh_jobs.store.pop(current_user.id)
+    return status
+
+#   \brief - Writes the files changed during a request, once it has finished.
+
+#   Runs on teardown, so the files are written even if the view raised an exception.
+
+#   \param error - The exception raised by the request, or None.
+
+@main_bp.teardown_app_request
+def flush_files(error):
+    storage.flush()
 
 #Render the homepage.
 @main_bp.route("/")
@@ -519,22 +774,69 @@ def home():
 @main_bp.route("/dashboard", methods=['GET', 'POST'])
 @login_required
 def dashboard():
-    alerts = read_json(alerts_path,False) #Read alerts from alerts file.
+    alerts = Alert.query.filter_by(user_id=current_user.id).order_by(Alert.created_at.desc(), Alert.id.desc()).all()
     for alert in alerts:
-        flash(alert)
-    write_json([],alerts_path) #Wipe all alerts once they have been displayed.
-    if request.method == 'POST':
-        if request.form['refresh'] == 'Refresh feeds':
-            refresh() #Refresh the page if the user clicks on the "Refresh feeds" button.
-    return render_template('dashboard.html', current_user = current_user.name, issues_data = session['issues_data'], common_words = session['common_words'], string_to_safe = session['string_to_safe'])
+        flash(alert.alert)
+    if alerts:
+        Alert.query.filter(Alert.id.in_([alert.id for alert in alerts])).delete(synchronize_session=False) #Delete the alerts once they have been displayed.
+        db.session.commit()
+    if request.method == 'POST' and request.form['refresh'] == 'Refresh feeds':
+        status, queued = queue_refresh() #Refresh the feeds in the background if the user clicks on the "Refresh feeds" button.
+    else:
+        status = get_refresh_status()
+    if status is not None and status['state'] in ("done","failed"):
+        status = None
+    data = get_user_data() #Show the latest data straight away, even while a refresh is in flight.
+    return render_template('dashboard.html', current_user = current_user.name, issues_data = data['issues_data'], common_words = data['common_words'], string_to_safe = data['string_to_safe'], refresh_status = status)
+
+#Report the progress of the user's refresh.
+@main_bp.route("/refresh/status")
+@login_required
+def refresh_status():
+    status = get_refresh_status()
+    if status is None:
+        status = {'state': "idle"}
+    return jsonify(status)
+
+#Render the trends in the user's tracked issues, outlets or popular topics over a number of days.
+@main_bp.route("/trends")
+@login_required
+def trends():
+    kind = request.args.get('kind',"issue")
+    if kind not in rollup_kinds:
+        kind = "issue"
+    days = min(max(request.args.get('days',30,type=int),1),3650) #Ten years is more than any retention, and larger ranges overflow the date.
+    snapshots, series = get_trends(kind,datetime.now()-timedelta(days=days))
+    rows = []
+    for name in series:
+        counts = series[name]
+        rows.append({'name': name, 'latest': counts[-1], 'change': counts[-1]-counts[0], 'peak': max(counts), 'points': sparkline(counts)})
+    rows.sort(key=lambda row: (-row['latest'],row['name']))
+    return render_template('trends.html', current_user = current_user.name, kind = kind, days = days, snapshots = snapshots, rows = rows)
+
+#Return the trends in the user's tracked issues, outlets or popular topics as JSON, for any range of times and any names.
+@main_bp.route("/trends/data")
+@login_required
+def trends_data():
+    kind = request.args.get('kind',"issue")
+    if kind not in rollup_kinds:
+        return jsonify({'error': "kind must be one of "+", ".join(rollup_kinds)+"."}), 400
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'),True)
+    except ValueError:
+        return jsonify({'error': "start and end must be ISO 8601 dates or times."}), 400
+    names = request.args.getlist('name') or None
+    snapshots, series = get_trends(kind,start,end,names)
+    return jsonify({'kind': kind, 'snapshots': snapshots, 'series': series})
 
 #Render a page full of stories for each issue.
 @main_bp.route("/issue/<issue_name>")
 @login_required
 def get_issue(issue_name):
-    issues_data = session.get('issues_data')
-    safe_to_string = session.get('safe_to_string')
-    return render_template('view_issue.html', issue_data = issues_data[safe_to_string[issue_name]], issue = safe_to_string[issue_name])
+    data = get_user_data()
+    issue = data['safe_to_string'][issue_name]
+    return render_template('view_issue.html', issue_data = data['issues_data'][issue], issue = issue)
 
 #Renders a search bar if the page is loaded directly or the search bar is empty, but otherwise loads search results.
 @main_bp.route("/search", methods=['GET', 'POST'])
@@ -545,13 +847,19 @@ def search_tags():
             word = request.args['word']
         except KeyError:
             return (render_template('search_get.html', current_user = current_user.name))
-        search_data, count = search(word,session.get('feeds'))
-        return (render_template('view_search.html', current_user = current_user.name, search_query = word, search_data = search_data, count=count))
-    search_tags_str = request.form.get('search')
-    if search_tags_str == "":
-        return (render_template('search_get.html', current_user = current_user.name))
-    search_data, count = search(search_tags_str,session.get('feeds'))
-    return (render_template('view_search.html', current_user = current_user.name, search_query = search_tags_str, search_data = search_data, count=count))
+        history = request.args.get('history') == "1"
+        page = request.args.get('page',1,type=int)
+    else:
+        word = request.form.get('search')
+        if word == "":
+            return (render_template('search_get.html', current_user = current_user.name))
+        history = request.form.get('history') == "1" #Search every story ever archived rather than just the latest snapshot.
+        page = 1
+    if history:
+        entries, page, has_next = search_all_history(word,page)
+        return (render_template('view_search.html', current_user = current_user.name, search_query = word, history = True, entries = entries, page=page, has_next=has_next))
+    search_data, count, page, pages = search(word,get_user_data(),page)
+    return (render_template('view_search.html', current_user = current_user.name, search_query = word, history = False, search_data = search_data, count=count, page=page, pages=pages))
 
 #Creates a redirect to /search with word as the search term.
 
@@ -660,6 +968,10 @@ def track_target(target):
                     message = "Added issue: "+added_key+" - "+added_vals+"."
                 else:
                     message = "Added outlet: "+added_key+"." #Add keys and values to relevant dictionary and save the changes to file. Set the message to say which issue has been added, referring to whether the user is managing issues or outlets.
+        if target == "issues":
+            reload_issues() #Update the issues shown on the dashboard.
+        else:
+            forget_tracked_feeds()
     try:
         message
     except NameError:
@@ -674,14 +986,10 @@ def support_messaging():
     if request.method == "POST":
         new_message = request.form['send_msg']
         if new_message != "":
-            ts = datetime.now()
-            session['messages'].insert(0,{"sender":current_user.name,"date":ts.strftime("%B %d, %Y at %H:%M:%S"), "message":new_message})
-            write_json(session['messages'],messages_path)
-            #Write message to all the JSON file containing all the support messages sent by users.
-            all_messages = read_json(all_messages_path,False,False)
-            all_messages.insert(0,{"sender":current_user.name,"date":ts.strftime("%B %d, %Y at %H:%M:%S"), "message":new_message})
-            write_json(all_messages,all_messages_path,False)
-    return (render_template('support_messaging.html', current_user = current_user.name, messages=session['messages']))
+            db.session.add(Message(user_id=current_user.id, sender=current_user.name, message=new_message)) #Sending a message only inserts a single row.
+            db.session.commit()
+    messages, next_before = message_page(Message.query.filter_by(user_id=current_user.id),request.args.get('before',type=int),app.config['SUPPORT_PAGE_SIZE'])
+    return (render_template('support_messaging.html', current_user = current_user.name, messages=messages, next_before=next_before, date_format=message_date_format))
 
 #Creates an interface to change preferences, such as changing the username and password.
 @main_bp.route("/preferences", methods=['GET','POST'])
@@ -697,6 +1005,7 @@ def preferences():
                     current_user.password = generate_password_hash(new_password, method='sha256')
                     db.session.add(current_user)
                     db.session.commit()
+                    forget_user(current_user.id) #Stop serving the old password hash.
                     flash('Password successfully changed.')
                 else:
                     flash('Current password incorrect.')
@@ -713,6 +1022,7 @@ def preferences():
                         current_user.name = new_name
                         db.session.add(current_user)
                         db.session.commit()
+                        forget_user(current_user.id) #Stop serving the old username.
                         flash('Username succesfully changed.')
                     else:
                         flash('A user already exists with that username.')
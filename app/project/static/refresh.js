@@ -0,0 +1,23 @@
+//Polls the progress of the user's refresh, updating the dashboard until the refresh has finished and then reloading it.
+function pollRefresh() {
+    var status_div = document.getElementById('refresh-status');
+    fetch(status_div.dataset.url, {credentials: 'same-origin'})
+        .then(function(response) { return response.json(); })
+        .then(function(status) {
+            if (status.state == 'queued' || status.state == 'running') {
+                document.getElementById('refresh-stage').textContent = status.stage || status.state;
+                var list = document.getElementById('refresh-outlets');
+                list.innerHTML = '';
+                for (var outlet in status.outlets) {
+                    var item = document.createElement('li');
+                    item.textContent = outlet + ' - ' + status.outlets[outlet].done + ' of ' + status.outlets[outlet].total + ' feeds';
+                    list.appendChild(item);
+                }
+                setTimeout(pollRefresh, 1000);
+            } else {
+                window.location.assign(window.location.pathname); //Show the refreshed data and any messages from the refresh, without sending the refresh form again.
+            }
+        })
+        .catch(function() { setTimeout(pollRefresh, 5000); });
+}
+document.addEventListener('DOMContentLoaded', function() { setTimeout(pollRefresh, 1000); });
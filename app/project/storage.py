@@ -0,0 +1,99 @@
+import os
+import tempfile
+from flask import g, has_app_context
+from .cache import LRUCache
+
+#   \brief - Reads and writes the small text files kept in each user's directory, with as few file system calls as possible.
+
+#   Directories are only created once per process. Files are written atomically, by writing a temporary file and renaming it over the old one, so that other workers never read a half-written file. Writes which would not change a file are skipped. Writes made during a request are held until the end of the request, so that a file written several times is only written once.
+
+class FileStore:
+
+#   \brief - Creates the store.
+
+#   \param cache_size - The number of files whose last known contents are remembered, to detect writes which would not change them.
+
+    def __init__(self,cache_size):
+        self.created_dirs = set() #The directories known to exist.
+        self.contents = LRUCache(cache_size) #The modification time, size and contents of recently read or written files, under their path as the key.
+
+#   \brief - Creates a directory and its parents, unless this process already has.
+    def ensure_dir(self,path):
+        if path not in self.created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self.created_dirs.add(path)
+
+#   \brief - Returns the writes waiting for the end of the current request, or None outside of a request.
+    def pending(self):
+        if not has_app_context():
+            return None
+        if '_pending_writes' not in g:
+            g._pending_writes = {}
+        return g._pending_writes
+
+#   \brief - Reads a text file, including any write to it still waiting for the end of the request.
+
+#   \param path - The path to the file.
+
+#   \returns - The contents of the file, or None if there is no such file.
+
+    def read(self,path):
+        pending = self.pending()
+        if pending and path in pending:
+            return pending[path]
+        try:
+            with open(path,"r") as text_file:
+                stat = os.fstat(text_file.fileno())
+                content = text_file.read()
+        except FileNotFoundError:
+            return None
+        self.contents.put(path,(stat.st_mtime_ns,stat.st_size,content))
+        return content
+
+#   \brief - Writes a text file, at the end of the current request if there is one, or straight away otherwise.
+
+#   \param path - The path to the file.
+#   \param content - The new contents of the file.
+
+    def write(self,path,content):
+        pending = self.pending()
+        if pending is None:
+            self.write_now(path,content)
+        else:
+            pending[path] = content
+
+#   \brief - Writes every file waiting for the end of the current request.
+    def flush(self):
+        pending = self.pending()
+        while pending:
+            path, content = pending.popitem()
+            self.write_now(path,content)
+
+#   \brief - Atomically writes a text file, unless it already holds the same contents.
+
+#   \param path - The path to the file.
+#   \param content - The new contents of the file.
+
+    def write_now(self,path,content):
+        known = self.contents.get(path)
+        if known is not None and known[2] == content:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_mtime_ns,stat.st_size) == known[:2]:
+                return #The file has not changed since it was last read or written, and would not be changed.
+        directory = os.path.dirname(path)
+        self.ensure_dir(directory)
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix="."+os.path.basename(path), suffix=".tmp")
+        try:
+            with os.fdopen(handle,"w") as temp_file:
+                temp_file.write(content)
+                temp_file.flush()
+                stat = os.fstat(temp_file.fileno())
+            os.replace(temp_path,path) #Readers see either the old file or the new one, never part of one.
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.contents.put(path,(stat.st_mtime_ns,stat.st_size,content))
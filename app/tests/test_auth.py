@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import event
+
+#   Tests loading the logged in user from the cache of recently loaded users: the cached copy is served without querying the database until the user's credential stamp advances, after which the user is loaded again.
+
+#   Run from the app directory: python -m unittest discover tests
+
+app = None
+directory = None
+
+#   \brief - Creates the application once for every test, with its database in a temporary directory and without sessions, as the user loader is called directly.
+def setUpModule():
+    global app, directory
+    directory = tempfile.mkdtemp()
+    os.environ.update(SECRET_KEY="test", SESSION_TYPE="null", SESSION_REDIS="redis://localhost:6379", SQLALCHEMY_DATABASE_URI="sqlite:///"+os.path.join(directory,"db.sqlite"))
+    from project import create_app
+    app = create_app()
+
+def tearDownModule():
+    shutil.rmtree(directory)
+
+class LoadUserTest(unittest.TestCase):
+
+    def setUp(self):
+        from project import db
+        from project.models import User
+        with app.app_context():
+            user = User(name="carol")
+            user.set_password("Abc123")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+            self.engine = db.engine
+        self.queries = 0
+        event.listen(self.engine,"before_cursor_execute",self.count_query)
+
+    def tearDown(self):
+        event.remove(self.engine,"before_cursor_execute",self.count_query)
+
+    def count_query(self,*args):
+        self.queries += 1
+
+#   \brief - Loads the user in a request of its own, as Flask-Login does, returning their name and the number of queries made.
+    def load(self):
+        from project.auth import load_user
+        queries = self.queries
+        with app.test_request_context():
+            return load_user(str(self.user_id)).name, self.queries-queries
+
+#   \brief - Renames the user in the database, as another worker process would, without telling this process's cache.
+    def rename(self,name):
+        from project import db
+        from project.models import User
+        with app.app_context():
+            db.session.get(User,self.user_id).name = name
+            db.session.commit()
+
+#   \brief - Checks that the cached copy is served without querying the database until the user's stamp advances, and that the user is then loaded again.
+    def test_stamp_reloads_cached_user(self):
+        from project.routes import user_stamps
+        self.assertEqual(self.load()[0],"carol")
+        self.rename("carla")
+        self.assertEqual(self.load(),("carol",0))
+        user_stamps.advance(self.user_id)
+        name, queries = self.load()
+        self.assertEqual(name,"carla")
+        self.assertGreater(queries,0)
+        self.assertEqual(self.load(),("carla",0)) #Cached again under the new stamp.
+
+#   \brief - Checks that forget_user, called when a user changes their name or password, stops their cached copy being served.
+    def test_forget_user(self):
+        from project.routes import forget_user
+        self.load()
+        self.rename("carla")
+        forget_user(self.user_id)
+        self.assertEqual(self.load()[0],"carla")
+
+if __name__ == '__main__':
+    unittest.main()
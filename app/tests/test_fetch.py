@@ -0,0 +1,119 @@
+import time
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from project.fetch import fetch_all, FeedCache
+
+#   Tests fetching feeds from a local server, which serves a good feed, a feed which fails with a 500, a feed which answers too slowly, and a feed which only declares its encoding in its headers.
+
+#   Run from the app directory: python -m unittest discover tests
+
+feed_xml = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test feed</title><link>http://example.com/</link>
+<item><title>First story</title><link>http://example.com/first?utm_source=rss</link><description>&lt;p&gt;The first story.&lt;/p&gt;</description></item>
+<item><title>Second story</title><link>http://example.com/second</link><description>The second story.</description></item>
+</channel></rss>"""
+cyrillic_feed_xml = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Новости</title><link>http://example.com/</link>
+<item><title>Главная новость</title><link>http://example.com/main</link><description>Подробности.</description></item>
+</channel></rss>""" #Has no encoding in its XML declaration, so is only decoded correctly using the charset in its Content-Type.
+feed_etag = '"v1"'
+slow_delay = 1.5 #Seconds the slow feed takes to answer, which is longer than the deadline given to fetch_all.
+
+#   \brief - Serves the test feeds, remembering the conditional headers of each request.
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    requests = [] #The path and If-None-Match header of each request, in the order they arrived.
+
+    def log_message(self,*args):
+        pass
+
+    def do_GET(self):
+        FeedHandler.requests.append((self.path,self.headers.get("If-None-Match")))
+        if self.path == "/error":
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.path == "/slow":
+            time.sleep(slow_delay)
+        if self.path == "/cp1251":
+            body = cyrillic_feed_xml.encode("windows-1251")
+            self.send_response(200)
+            self.send_header("Content-Type","application/rss+xml; charset=windows-1251")
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.headers.get("If-None-Match") == feed_etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = feed_xml.encode()
+        self.send_response(200)
+        self.send_header("Content-Type","application/rss+xml")
+        self.send_header("ETag",feed_etag)
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FetchAllTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1",0),FeedHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever,daemon=True).start()
+        cls.root = "http://127.0.0.1:"+str(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FeedHandler.requests = []
+
+#   \brief - Checks that a good feed is returned, while a failing feed and a slow feed are reported without holding up the others.
+    def test_failed_and_slow_feeds(self):
+        good, error, slow = self.root+"/good", self.root+"/error", self.root+"/slow"
+        results, failed, too_slow = fetch_all({"Outlet": [good,error,slow]},4,5,0.5)
+        self.assertEqual(failed,[error])
+        self.assertEqual(too_slow,[slow])
+        self.assertEqual([[entry['title'] for entry in feed] for feed in results["Outlet"]],[["First story","Second story"]])
+        self.assertEqual(results["Outlet"][0][0]['link'],"http://example.com/first") #Tracking parameters are removed from the link identifying the story.
+        self.assertEqual(results["Outlet"][0][0]['url'],"http://example.com/first?utm_source=rss") #The link shown to users is kept as published.
+        self.assertEqual(results["Outlet"][0][0]['summary'],"The first story.")
+
+#   \brief - Checks that an expired cached feed is revalidated with its ETag, and that a 304 response serves the cached stories.
+    def test_revalidation(self):
+        cache = FeedCache()
+        good = self.root+"/good"
+        first, failed, slow = fetch_all({"Outlet": [good]},1,5,5,cache,0)
+        second, failed, slow = fetch_all({"Outlet": [good]},1,5,5,cache,0)
+        self.assertEqual((failed,slow),([],[]))
+        self.assertEqual(second,first)
+        self.assertEqual(FeedHandler.requests,[("/good",None),("/good",feed_etag)])
+        stats = cache.stats()
+        self.assertEqual((stats["misses"],stats["revalidations"],stats["hits"]),(1,1,0))
+
+#   \brief - Checks that a cached feed younger than the ttl is served without contacting its server.
+    def test_fresh_cache_hit(self):
+        cache = FeedCache()
+        good = self.root+"/good"
+        fetch_all({"Outlet": [good]},1,5,5,cache,60)
+        results, failed, slow = fetch_all({"Outlet": [good]},1,5,5,cache,60)
+        self.assertEqual(len(FeedHandler.requests),1)
+        self.assertEqual(len(results["Outlet"][0]),2)
+        self.assertEqual(cache.stats()["hits"],1)
+
+#   \brief - Checks that a feed which only declares its encoding in the Content-Type charset is decoded with that encoding.
+    def test_charset_from_headers(self):
+        results, failed, slow = fetch_all({"Outlet": [self.root+"/cp1251"]},1,5,5)
+        self.assertEqual((failed,slow),([],[]))
+        entry = results["Outlet"][0][0]
+        self.assertEqual(entry['title'],"Главная новость")
+        self.assertEqual(entry['summary'],"Подробности.")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import re
+import random
+import shutil
+import tempfile
+import unittest
+from project.index import InvertedIndex, saved_revision
+from project.matching import Matcher
+from project.pipeline import build_snapshot, iter_feeds
+
+#   Tests the inverted index against a scan of every story, and that saving it to the archive database and reading it back gives the same index, whether it is saved whole or a few rows at a time.
+
+#   Run from the app directory: python -m unittest discover tests
+
+vocabulary = ["police","court","Queen","prince","Harry","election","vote","NHS","hospital","energy","gas","prices","school","trade","deal","Covid-19","U.S.","don't","café","Straße"]
+
+#   \brief - Ranks a story the way stories were ranked before the index, by scanning the title and summary with a regular expression for every term.
+
+#   Case-folds rather than lower-casing, as stories and terms are now case-folded, eg. so that "Straße" matches "STRASSE".
+
+#   \param terms - The list of terms to be matched within the story.
+#   \param entry - The story.
+
+#   \returns - The ranking of the story.
+
+def scan_rank(terms,entry):
+    rank = 0
+    for term in terms:
+        nopunc_term = re.sub(r'[^\w\s]','',term.casefold())
+        nopunc_title = re.sub(r'[^\w\s]','',entry['title'].casefold())
+        nopunc_summary = re.sub(r'[^\w\s]','',entry['summary'].casefold())
+        test_whole_word = re.compile(r'\b({0})\b'.format(nopunc_term), flags=re.IGNORECASE).search
+        if test_whole_word(nopunc_title):
+            rank += 2
+        if test_whole_word(nopunc_summary):
+            rank += 1
+    return rank
+
+#   \brief - Returns a story made of random words from the vocabulary.
+
+#   \param generator - The random number generator.
+#   \param number - The number of the story, which makes its link.
+
+#   \returns - The story.
+
+def make_story(generator,number):
+    title = " ".join(generator.choice(vocabulary) for word in range(generator.randint(1,6)))
+    summary = ", ".join(generator.choice(vocabulary) for word in range(generator.randint(0,12)))+"."
+    return {'title': title, 'summary': summary, 'link': "http://example.com/story/"+str(number), 'published': ""}
+
+#   \brief - Builds a snapshot from lists of stories.
+
+#   \param feeds - A dictionary with a list for each outlet, containing the list of stories of each feed.
+
+#   \returns - The data dictionary of the snapshot.
+
+def make_snapshot(feeds):
+    return build_snapshot(iter_feeds(feeds))
+
+#   \brief - Returns everything an index holds, for comparing two indexes.
+def index_state(index):
+    return {'version': index.version, 'next_id': index.next_id, 'docs': index.docs, 'postings': index.postings,
+            'outlets': index.outlets, 'current': index.current, 'issues': index.issues}
+
+class MatcherTest(unittest.TestCase):
+
+#   \brief - Checks that the matcher, and the index's posting lists, rank every story the same as scanning it would.
+    def test_same_ranking_as_scan(self):
+        generator = random.Random(5)
+        stories = [make_story(generator,number) for number in range(300)]
+        data = make_snapshot({"Outlet": [stories]})
+        index = InvertedIndex()
+        index.update(data)
+        term_lists = [["police"],["Police","court"],["prince harry"],["U.S."],["covid-19","NHS"],["don't"],["cafe"],["café","STRASSE"],["gas prices","energy"],["election","election"],["nothing"]]
+        for terms in term_lists:
+            matcher = Matcher(terms)
+            expected = {}
+            for entry in data['entries'].values():
+                ranking = scan_rank(terms,entry)
+                self.assertEqual(matcher.rank(entry),ranking,(terms,entry['title'],entry['summary']))
+                if ranking != 0:
+                    expected[entry['link']] = ranking
+            ranks = index.rank(terms,index.docs)
+            self.assertEqual({index.docs[doc_id]['link']: ranking for doc_id, ranking in ranks.items() if ranking != 0},expected,terms)
+
+class InvertedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory,"archive.db")
+        generator = random.Random(7)
+        self.stories = [make_story(generator,number) for number in range(60)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+#   \brief - Checks that an index read back from the database is the same as the index which was saved.
+    def assertSaved(self,index):
+        loaded = InvertedIndex.load(self.db_path)
+        self.assertEqual(index_state(loaded),index_state(index))
+        self.assertEqual(loaded.revision,saved_revision(self.db_path))
+        return loaded
+
+#   \brief - Checks that an index survives being saved and read back, with its issues' rankings.
+    def test_save_and_load(self):
+        index = InvertedIndex()
+        index.update(make_snapshot({"First": [self.stories[:20]], "Second": [self.stories[10:30],self.stories[30:40]]}))
+        index.match_issue("Royals",["prince","queen"])
+        index.match_issue("Health",["NHS","hospital"])
+        self.assertIsNone(saved_revision(self.db_path))
+        self.assertEqual(index.save(self.db_path),1)
+        loaded = self.assertSaved(index)
+        self.assertEqual(sorted(loaded.search(["police"])),sorted(index.search(["police"])))
+        self.assertEqual(loaded.match_issue("Royals",["prince","queen"]),index.match_issue("Royals",["prince","queen"]))
+
+#   \brief - Checks that saving only what has changed gives the same index as saving it whole, as stories are added, re-matched and pruned.
+    def test_incremental_save(self):
+        index = InvertedIndex()
+        index.update(make_snapshot({"Outlet": [self.stories[:30]]}))
+        index.match_issue("Royals",["prince","queen"])
+        index.save(self.db_path)
+        index.update(make_snapshot({"Outlet": [self.stories[20:50]]}))
+        self.assertEqual(index.added,set(range(30,50)))
+        index.match_issue("Royals",["prince","queen"]) #Only the new stories are matched.
+        self.assertEqual(index.prune({story['link'] for story in self.stories[10:20]}),10) #Keeps stories still in the archive, and those in the current snapshot.
+        self.assertEqual(index.save(self.db_path),2)
+        self.assertEqual((index.added,index.removed,index.changed_issues),(set(),set(),set()))
+        loaded = self.assertSaved(index)
+        self.assertEqual(set(loaded.docs),set(range(10,50)))
+
+#   \brief - Checks that pruned stories are removed from the posting lists and the issues' rankings.
+    def test_prune(self):
+        index = InvertedIndex()
+        old = {'title': "Unique zebra story", 'summary': "About a zebra.", 'link': "http://example.com/zebra", 'published': ""}
+        index.update(make_snapshot({"Outlet": [[old]+self.stories[:10]]}))
+        index.match_issue("Zebras",["zebra"])
+        index.save(self.db_path)
+        index.update(make_snapshot({"Outlet": [self.stories[:10]]}))
+        self.assertEqual(index.prune(set()),1)
+        self.assertNotIn("zebra",index.postings['title'])
+        self.assertNotIn("zebra",index.postings['summary'])
+        self.assertEqual(index.issues["Zebras"]['ranks'],{})
+        self.assertEqual(index.match_issue("Zebras",["zebra"]),({},0))
+        self.assertEqual(index.prune(set()),0) #Stories in the current snapshot are never pruned.
+        index.save(self.db_path)
+        self.assertSaved(index)
+
+#   \brief - Checks that forgotten issues are removed from the saved index.
+    def test_forget_issues(self):
+        index = InvertedIndex()
+        index.update(make_snapshot({"Outlet": [self.stories]}))
+        index.match_issue("Royals",["prince","queen"])
+        index.match_issue("Health",["NHS"])
+        index.save(self.db_path)
+        index.forget_issues({"Health"})
+        self.assertEqual(index.forgotten,{"Royals"})
+        index.save(self.db_path)
+        loaded = self.assertSaved(index)
+        self.assertEqual(set(loaded.issues),{"Health"})
+
+#   \brief - Checks that a copy of the index saved after another process has saved it is written whole, replacing what the other process saved.
+    def test_concurrent_writer_rewrites_whole_index(self):
+        index = InvertedIndex()
+        index.update(make_snapshot({"Outlet": [self.stories[:20]]}))
+        index.match_issue("Royals",["prince","queen"])
+        index.save(self.db_path)
+        first = InvertedIndex.load(self.db_path)
+        second = InvertedIndex.load(self.db_path)
+        second.update(make_snapshot({"Outlet": [self.stories[20:40]]}))
+        second.match_issue("Health",["NHS"])
+        self.assertEqual(second.save(self.db_path),2)
+        first.update(make_snapshot({"Outlet": [self.stories[:10]+self.stories[40:]]}))
+        first.match_issue("Royals",["prince","queen"])
+        self.assertEqual(first.save(self.db_path),3) #Its copy was read at revision 1, so it cannot only write its own changes.
+        loaded = self.assertSaved(first)
+        self.assertNotIn("Health",loaded.issues)
+        self.assertEqual(first.save(self.db_path),4) #Once written whole, only changes are written again.
+        self.assertSaved(first)
+
+if __name__ == '__main__':
+    unittest.main()
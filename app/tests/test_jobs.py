@@ -0,0 +1,106 @@
+import time
+import threading
+import unittest
+from project.jobs import MemoryJobStore, RefreshQueue
+
+#   Tests running refresh jobs with the memory job store: coalescing a refresh with the one already in flight, releasing the claim when a job fails, and the claim's lease running out unless it is renewed.
+
+#   Run from the app directory: python -m unittest discover tests
+
+#   \brief - Waits for a user's latest refresh to finish, returning its status.
+
+#   \param queue - The refresh queue.
+#   \param user_id - The id of the user.
+
+#   \returns - The status of the refresh, once it is no longer queued or running.
+
+def wait_for_job(queue,user_id):
+    deadline = time.time()+5
+    while time.time() < deadline:
+        status = queue.status(user_id)
+        if status is not None and status['state'] not in ("queued","running"):
+            return status
+        time.sleep(0.01)
+    raise AssertionError("The refresh did not finish")
+
+class RefreshQueueTest(unittest.TestCase):
+
+#   \brief - Checks that a refresh requested while another is in flight returns the status of the one in flight, without running the job again.
+    def test_coalescing(self):
+        queue = RefreshQueue(MemoryJobStore(5),2)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+        def job(progress):
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'stage': "finished"}
+        first, queued = queue.enqueue(1,job)
+        self.assertTrue(queued)
+        self.assertTrue(started.wait(5))
+        second, queued = queue.enqueue(1,job)
+        self.assertFalse(queued)
+        self.assertEqual((second['id'],second['state']),(first['id'],"running"))
+        other, queued = queue.enqueue(2,lambda progress: {}) #Other users' refreshes are not held up.
+        self.assertTrue(queued)
+        release.set()
+        self.assertEqual(wait_for_job(queue,1)['stage'],"finished")
+        self.assertEqual(len(calls),1)
+        self.assertEqual(wait_for_job(queue,2)['state'],"done")
+
+#   \brief - Checks that a failed refresh is logged and reported, and releases its claim so the user can refresh again.
+    def test_failure_releases_claim(self):
+        queue = RefreshQueue(MemoryJobStore(5),1)
+        def job(progress):
+            raise ValueError("no feeds")
+        with self.assertLogs("project.jobs","ERROR"):
+            queue.enqueue(1,job)
+            status = wait_for_job(queue,1)
+        self.assertEqual(status['state'],"failed")
+        self.assertEqual(status['messages'],["Refreshing feeds failed: no feeds"])
+        deadline = time.time()+5
+        while not queue.store.claim(1,"next") and time.time() < deadline: #The claim is released just after the failed status is saved.
+            time.sleep(0.01)
+        self.assertEqual(queue.store.claims[1][0],"next")
+
+#   \brief - Checks that a job running longer than a lease keeps its claim by renewing it.
+    def test_renewal(self):
+        queue = RefreshQueue(MemoryJobStore(0.3),1)
+        release = threading.Event()
+        first, queued = queue.enqueue(1,lambda progress: release.wait(5) and {})
+        time.sleep(1)
+        self.assertFalse(queue.store.claim(1,"other"))
+        self.assertEqual(queue.status(1)['state'],"running")
+        self.assertGreater(queue.status(1)['renewed'],first['queued'])
+        release.set()
+        self.assertEqual(wait_for_job(queue,1)['state'],"done")
+
+#   \brief - Checks that a job whose claim is no longer renewed is reported as interrupted.
+    def test_interrupted_job(self):
+        queue = RefreshQueue(MemoryJobStore(0.2),1)
+        queue.store.put(1,{'id': "dead", 'state': "running", 'stage': "", 'outlets': {}, 'messages': [], 'queued': time.time(), 'renewed': time.time()})
+        self.assertEqual(queue.status(1)['state'],"running")
+        time.sleep(0.3)
+        status = queue.status(1)
+        self.assertEqual(status['state'],"failed")
+        self.assertEqual(status['messages'],["Refreshing feeds was interrupted, please try again."])
+
+class MemoryJobStoreTest(unittest.TestCase):
+
+#   \brief - Checks that a claim which is not renewed expires after its lease, and that its job can then neither renew nor release the new claim.
+    def test_lease_expiry(self):
+        store = MemoryJobStore(0.2)
+        self.assertTrue(store.claim(1,"first"))
+        self.assertFalse(store.claim(1,"second"))
+        self.assertTrue(store.renew(1,"first"))
+        self.assertFalse(store.renew(1,"second"))
+        time.sleep(0.3)
+        self.assertFalse(store.renew(1,"first"))
+        self.assertTrue(store.claim(1,"second"))
+        store.release(1,"first")
+        self.assertFalse(store.claim(1,"third")) #Releasing an expired claim leaves the new claim alone.
+        store.release(1,"second")
+        self.assertTrue(store.claim(1,"third"))
+
+if __name__ == '__main__':
+    unittest.main()